@@ -0,0 +1,206 @@
+'''
+Агрегаты игры для статистики и дашбордов. Обновляются за один проход: выборы - в Repository.Choice,
+TOTAL, образование и ипотека - после Gamble. Читать их дешево, пересчитывать Repository.data не нужно.
+
+Все агрегаты сливаются (merge): можно сложить несколько игр турнира или шарды воркеров.
+Квантили приближенные, с относительной ошибкой alpha (QuantileSketch).
+'''
+import math
+
+import numpy as np
+
+from repository import OPTIONS, OPTION_CODES
+
+
+class QuantileSketch:
+    '''
+    Приближенные квантили по логарифмическим корзинам (как в DDSketch): значение x > 0 попадает в корзину
+    ceil(log_gamma(x)), gamma = (1 + alpha) / (1 - alpha), и оценка любого квантиля отличается от точного
+    не больше чем в (1 ± alpha) раз. Скетчи с одним alpha сливаются сложением счетчиков
+    '''
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self._gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self._gamma)
+        self.positive = {}  # корзина -> число значений
+        self.negative = {}  # то же для -x при x < 0
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def _add(self, store, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def update(self, values):
+        '''
+        :param values: np.array, NaN пропускаются
+        :return: self
+        '''
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self._add(self.positive, values[values > 0])
+        self._add(self.negative, -values[values < 0])
+        self.zero += int((values == 0).sum())
+        self.count += len(values)
+        self.sum += float(values.sum())
+        return self
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError(f'cannot merge sketches with alpha {self.alpha} and {other.alpha}')
+        merged = QuantileSketch(self.alpha)
+        for sketch in (self, other):
+            for store, merged_store in ((sketch.positive, merged.positive), (sketch.negative, merged.negative)):
+                for key, count in store.items():
+                    merged_store[key] = merged_store.get(key, 0) + count
+            merged.zero += sketch.zero
+            merged.count += sketch.count
+            merged.sum += sketch.sum
+        return merged
+
+    def _value(self, key):
+        return 2 * self._gamma ** key / (self._gamma + 1)
+
+    def quantile(self, q):
+        '''
+        :param q: от 0 до 1
+        :return: приближенный квантиль, None если значений нет
+        '''
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+
+class RoundAggregates:
+    '''
+    Выборы одного года
+    :param counts: число выборов - np.array (3 × опции)
+    :param invested: сумма активов прошлого года, вложенная в опцию - np.array (3 × опции)
+    '''
+
+    def __init__(self, counts, invested, players):
+        self.counts = counts
+        self.invested = invested
+        self.players = players
+
+    def merge(self, other):
+        return RoundAggregates(self.counts + other.counts, self.invested + other.invested,
+                               self.players + other.players)
+
+    def popularity(self):
+        '''
+        :return: доля выборов каждой опции по активам - np.array (3 × опции)
+        '''
+        return self.counts / max(self.players, 1)
+
+
+class GameAggregates:
+    '''
+    :param alpha: точность квантилей TOTAL, см. QuantileSketch
+    '''
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.rounds = {}  # год -> RoundAggregates
+        self.year = None  # год, после которого посчитано состояние ниже
+        self.players = 0
+        self.wealth = QuantileSketch(alpha)  # TOTAL
+        self.education = np.zeros(0, dtype=np.int64)  # число игроков по уровню образования
+        self.mortgage = np.zeros(0, dtype=np.int64)  # число игроков по mortgage_count
+
+    def record_choices(self, year, codes, previous_assets):
+        '''
+        :param codes: коды выборов по трем активам (см. repository.encode_choices)
+        :param previous_assets: активы прошлого года по трем активам
+        :return: RoundAggregates
+        '''
+        n_codes = len(OPTIONS)
+        counts = np.zeros((3, n_codes), dtype=np.int64)
+        invested = np.zeros((3, n_codes))
+        for slot, (slot_codes, assets) in enumerate(zip(codes, previous_assets)):
+            known = slot_codes < n_codes
+            counts[slot] = np.bincount(slot_codes[known], minlength=n_codes)
+            invested[slot] = np.bincount(slot_codes[known], weights=np.asarray(assets, dtype=float)[known],
+                                         minlength=n_codes)
+        self.rounds[year] = RoundAggregates(counts, invested, len(codes[0]))
+        return self.rounds[year]
+
+    def record_state(self, year, totals, educ, mortgage_count):
+        '''
+        Состояние игроков после Gamble (или при загрузке игры)
+        :return: self
+        '''
+        self.year = year
+        self.players = len(totals)
+        self.wealth = QuantileSketch(self.alpha).update(totals)
+        self.education = _bincount(educ)
+        self.mortgage = _bincount(mortgage_count)
+        return self
+
+    def crowd_ratios(self, year, total_sum):
+        '''
+        N_together и N_only для Gamble
+        :param total_sum: сумма TOTAL на начало года
+        :return: (доля TOTAL, вложенная в stock_together, доля выборов stock_only на игрока)
+        '''
+        round_ = self.rounds[year]
+        n_together = round_.invested[:, OPTION_CODES['stock_together']].sum() / total_sum
+        n_only = round_.counts[:, OPTION_CODES['stock_only']].sum() / round_.players
+        return n_together, n_only
+
+    def merge(self, other):
+        '''
+        Сумма агрегатов двух игр (или шардов), годы сопоставляются по номеру
+        :return: новый GameAggregates
+        '''
+        merged = GameAggregates(self.alpha)
+        for year in set(self.rounds) | set(other.rounds):
+            rounds = [game.rounds[year] for game in (self, other) if year in game.rounds]
+            merged.rounds[year] = rounds[0] if len(rounds) == 1 else rounds[0].merge(rounds[1])
+        merged.year = max((year for year in (self.year, other.year) if year is not None), default=None)
+        merged.players = self.players + other.players
+        merged.wealth = self.wealth.merge(other.wealth)
+        merged.education = _add(self.education, other.education)
+        merged.mortgage = _add(self.mortgage, other.mortgage)
+        return merged
+
+    def summary(self, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+        '''
+        :return: dict для дашборда
+        '''
+        last = self.rounds.get(self.year)
+        return {'year': self.year, 'players': self.players,
+                'total_sum': self.wealth.sum,
+                'total_mean': self.wealth.sum / self.players if self.players else None,
+                'total_quantiles': {q: self.wealth.quantile(q) for q in quantiles},
+                'education': self.education.tolist(),
+                'mortgage_count': self.mortgage.tolist(),
+                'popularity': None if last is None else
+                {option: last.counts[:, code].tolist() for code, option in enumerate(OPTIONS)}}
+
+
+def _bincount(values):
+    values = np.asarray(values)
+    values = values[~np.isnan(values)].astype(np.int64) if values.dtype.kind == 'f' else values.astype(np.int64)
+    return np.bincount(np.clip(values, 0, None))
+
+
+def _add(a, b):
+    size = max(len(a), len(b))
+    return np.pad(a, (0, size - len(a))) + np.pad(b, (0, size - len(b)))
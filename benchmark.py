@@ -0,0 +1,184 @@
+'''
+Бенчмарк движка: Repository.Choice + Gamble на заглушке вместо базы.
+
+Сетка: число игроков × распределение выборов, в каждом случае играется years лет подряд, по каждому раунду
+пишется время, а по случаю - пиковая память (tracemalloc, отдельным прогоном) и ширина Repository.data.
+Результаты сохраняются в JSON, чтобы сравнивать между коммитами:
+
+    python benchmark.py --players 10 1000 100000 --years 20 --out bench_new.json
+    python benchmark.py --compare bench_old.json bench_new.json
+'''
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from persistence import Backend, PLAYER_FIELDS
+from repository import OPTIONS, Repository
+
+MIXES = ('all_mortgage', 'uniform', 'herd_together')
+
+
+class StubBackend(Backend):
+    '''
+    Хранилище-заглушка: колонки игроков сразу массивами, запись никуда не идет
+    '''
+
+    def __init__(self, n_players, initial_asset=100.0):
+        self.n_players = n_players
+        self.initial_asset = initial_asset
+
+    def load_players(self):
+        n = self.n_players
+        columns = {field: np.zeros(n, dtype=np.int64) for field in PLAYER_FIELDS}
+        columns['ID'] = np.arange(1, n + 1)
+        columns['Name'] = np.full(n, '', dtype=object)
+        for field in ('Active_a', 'Active_b', 'Active_c'):
+            columns[field] = np.full(n, self.initial_asset)
+        columns['TOTAL'] = columns['Active_a'] * 3
+        return columns
+
+    def current_year(self):
+        return 0
+
+    def ranked_players(self):
+        return []
+
+    def save_players(self, columns, batch_size=500):
+        return len(columns['ID'])
+
+
+def make_choices(rng, mix, n_players):
+    '''
+    :return: три массива выборов (по активам) для одного года
+    '''
+    options = np.asarray(OPTIONS, dtype=object)
+    if mix == 'all_mortgage':
+        return [np.full(n_players, 'mortgage', dtype=object) for _ in range(3)]
+    if mix == 'uniform':
+        return [options[rng.integers(0, len(options), n_players)] for _ in range(3)]
+    if mix == 'herd_together':
+        herd = []
+        for _ in range(3):
+            choices = options[rng.integers(0, len(options), n_players)]
+            choices[rng.random(n_players) < 0.8] = 'stock_together'
+            herd.append(choices)
+        return herd
+    raise ValueError(f'unknown mix {mix!r}')
+
+
+def play(n_players, years, mix, engine='vector', seed=0):
+    '''
+    Один случай сетки
+    :return: (время по раундам в секундах, ширина датафрейма по раундам)
+    '''
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+    repo = Repository(None, backend=StubBackend(n_players), engine=engine)
+    round_seconds = []
+    width = []
+    for year in range(1, years + 1):
+        choices = make_choices(rng, mix, n_players)
+        start = time.perf_counter()
+        repo.Choice(year, *choices)
+        repo.Gamble(year)
+        round_seconds.append(time.perf_counter() - start)
+        width.append(repo.data.shape[1])
+    return round_seconds, width
+
+
+def peak_memory(n_players, years, mix, engine='vector', seed=0):
+    tracemalloc.start()
+    try:
+        play(n_players, years, mix, engine=engine, seed=seed)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(players=(10, 1000, 100000), years=20, mixes=MIXES, engine='vector', memory=True, seed=0):
+    '''
+    Прогон всей сетки
+    :return: dict для сохранения в JSON
+    '''
+    cases = []
+    for n_players in players:
+        for mix in mixes:
+            round_seconds, width = play(n_players, years, mix, engine=engine, seed=seed)
+            case = {'players': n_players, 'years': years, 'mix': mix,
+                    'round_seconds': round_seconds,
+                    'mean_round_seconds': float(np.mean(round_seconds)),
+                    'width': width}
+            if memory:
+                case['peak_bytes'] = peak_memory(n_players, years, mix, engine=engine, seed=seed)
+            cases.append(case)
+    return {'commit': _commit(), 'engine': engine, 'python': platform.python_version(),
+            'numpy': np.__version__, 'cases': cases}
+
+
+def compare(old, new):
+    '''
+    Сравнение двух прогонов по среднему времени раунда и пиковой памяти
+    :return: list из dict по общим случаям, ratio > 1 - стало медленнее/тяжелее
+    '''
+    key = lambda case: (case['players'], case['years'], case['mix'])
+    old_cases = {key(case): case for case in old['cases']}
+    rows = []
+    for case in new['cases']:
+        before = old_cases.get(key(case))
+        if before is None:
+            continue
+        row = {'players': case['players'], 'years': case['years'], 'mix': case['mix'],
+               'time_ratio': case['mean_round_seconds'] / before['mean_round_seconds']}
+        if 'peak_bytes' in case and 'peak_bytes' in before:
+            row['memory_ratio'] = case['peak_bytes'] / before['peak_bytes']
+        rows.append(row)
+    return rows
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Engine benchmark on a stub persistence layer')
+    parser.add_argument('--players', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--years', type=int, default=20)
+    parser.add_argument('--mix', nargs='+', default=list(MIXES), choices=MIXES)
+    parser.add_argument('--engine', default='vector', choices=['vector', 'loop'])
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as file:
+            old = json.load(file)
+        with open(args.compare[1]) as file:
+            new = json.load(file)
+        for row in compare(old, new):
+            print(json.dumps(row))
+        return
+
+    results = run(args.players, args.years, args.mix, engine=args.engine, memory=not args.no_memory,
+                  seed=args.seed)
+    for case in results['cases']:
+        print(f"{case['players']:>8} players  {case['mix']:<14} {case['mean_round_seconds'] * 1000:9.2f} ms/round"
+              f"  width {case['width'][-1]:>3}"
+              + (f"  peak {case['peak_bytes'] / 2 ** 20:8.1f} MiB" if 'peak_bytes' in case else ''))
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump(results, file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Кеш ответов для чтения (рейтинг, история игрока, статистика). Ключ - (айди игры, поколение, запрос).
+Поколение Repository.generation меняется на каждом Gamble, поэтому все записи прошлого раунда перестают
+находиться сразу и выбрасываются одним действием при первом запросе с новым поколением.
+
+Single-flight: если запись считается, остальные запросы того же ключа ждут ее, а не считают заново -
+шквал обновлений страниц сразу после раунда считает каждую запись один раз.
+'''
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ResponseCache:
+    '''
+    :param max_entries: сколько записей держать по всем играм, лишние вытесняются по LRU
+    '''
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (игра, поколение, запрос) -> значение, от давних к недавним
+        self._keys = {}  # игра -> ключи ее записей
+        self._generations = {}  # игра -> последнее виденное поколение
+        self._flights = {}  # ключ -> Future записи, которая сейчас считается
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, game_id, generation, request, fill):
+        '''
+        :param request: hashable описание запроса, например ('history', player_id)
+        :param fill: функция без аргументов, которая считает значение при промахе
+        :return: значение (общее для всех читателей - не менять)
+        '''
+        key = (game_id, generation, request)
+        with self._lock:
+            current = self._generations.get(game_id)
+            if current is None or generation > current:
+                self._drop(game_id)
+                self._generations[game_id] = generation
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = Future()
+        if not owner:
+            return flight.result()
+        try:
+            value = fill()
+        except BaseException as e:
+            with self._lock:
+                del self._flights[key]
+            flight.set_exception(e)
+            raise
+        with self._lock:
+            del self._flights[key]
+            if generation == self._generations.get(game_id):  # читатель прошлого поколения не пишет в кеш
+                self._entries[key] = value
+                self._keys.setdefault(game_id, set()).add(key)
+                while len(self._entries) > self.max_entries:
+                    old, _ = self._entries.popitem(last=False)
+                    self._keys[old[0]].discard(old)
+        flight.set_result(value)
+        return value
+
+    def _drop(self, game_id):
+        for key in self._keys.pop(game_id, ()):
+            del self._entries[key]
+
+    def invalidate(self, game_id):
+        '''
+        Выбросить все записи игры (например, игру подняли из контрольной точки)
+        '''
+        with self._lock:
+            self._drop(game_id)
+            self._generations.pop(game_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,205 @@
+'''
+Контрольные точки игры после каждого Gamble. Живой датафрейм, история лет, входы «что было бы»
+(counterfactual.RoundInputs), выборы по раундам из aggregates, more_than_40 и параметры игры пишутся в один
+.npz на год: колонка - отдельный массив, строковые колонки (выборы, айди) - коды + таблица
+значений. Запись атомарная (временный файл, fsync, rename), старые годы остаются на диске:
+
+    store = CheckpointStore('/var/lib/freezy/game_12')
+    repo = Repository(12, checkpoints=store)     # точка пишется сама после каждого Gamble
+    ...
+    repo = store.load()                          # после рестарта - последний сыгранный год
+    repo = store.load(year=3)                    # откат к году 3 без переигровки
+'''
+import json
+import os
+import re
+import struct
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from aggregates import RoundAggregates
+from counterfactual import RoundInputs
+
+CHECKPOINT_FILE = re.compile(r'^year_(-?\d+)\.npz$')
+SAVED_FIELDS = ('Active_a', 'Active_b', 'Active_c', 'Mortgage_count', 'Further_mortgage', 'Now_mortgage',
+                'Education')
+
+
+class CheckpointStore:
+    '''
+    :param directory: папка игры, создается при первой записи
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, year):
+        return os.path.join(self.directory, f'year_{year}.npz')
+
+    def years(self):
+        '''
+        :return: годы, для которых есть контрольная точка, по возрастанию
+        '''
+        if not os.path.isdir(self.directory):
+            return []
+        matches = (CHECKPOINT_FILE.match(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def save(self, repo):
+        '''
+        Пишет состояние игры за repo.year. Точки более поздних лет удаляются: после отката они относятся
+        к отмененной ветке игры
+        :return: путь к файлу
+        '''
+        arrays = {}
+        meta = {'year': int(repo.year), 'more_than_40': bool(repo.more_than_40), 'inflation': float(repo.inflation),
+                'educ_dohod': float(repo.educ_dohod), 'engine': repo.engine,
+                'seed': None if repo.seed is None else int(repo.seed),
+                'tape': None if repo.tape is None else repo.tape.path,
+                'float_dtype': repo.schema.float_dtype.name, 'strict': repo.schema.strict,
+                'columns': [str(column) for column in repo.data.columns],
+                'years': [int(year) for year in repo.history.years],  # json не знает np.int64
+                'counterfactual_years': [int(year) for year in repo.counterfactuals.rounds],
+                'aggregate_rounds': [[int(year), int(round_.players)]
+                                     for year, round_ in repo.aggregates.rounds.items()]}
+        _pack(arrays, 'index', repo.data.index)
+        for column in repo.data.columns:
+            _pack(arrays, f'column:{column}', repo.data[column])
+        k = len(repo.history.years)
+        arrays['history:choices'] = repo.history._choices[:, :k]
+        arrays['history:assets'] = repo.history._assets[:, :k]
+        arrays['history:totals'] = repo.history._totals[:, :k]
+        arrays['history:state'] = repo.history._state[:, :k]
+        for field in SAVED_FIELDS:
+            arrays[f'saved:{field}'] = repo._saved[field]
+        for year, inputs in repo.counterfactuals.rounds.items():
+            for field in RoundInputs.FIELDS:
+                arrays[f'counterfactual:{year}:{field}'] = getattr(inputs, field)
+        for year, round_ in repo.aggregates.rounds.items():
+            arrays[f'aggregates:{year}:counts'] = round_.counts
+            arrays[f'aggregates:{year}:invested'] = round_.invested
+        arrays['meta'] = np.array(json.dumps(meta))
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(repo.year)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as file:
+            np.savez(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+        for year in self.years():
+            if year > repo.year:
+                os.remove(self.path(year))
+        return path
+
+    def latest(self):
+        years = self.years()
+        if not years:
+            raise FileNotFoundError(f'no checkpoints in {self.directory!r}')
+        return years[-1]
+
+    def open(self, year=None):
+        '''
+        Массивы контрольной точки через mmap только на чтение, без загрузки в память (для выгрузок)
+        :param year: какой год, None - последний
+        :return: (meta - dict, arrays - dict имя -> np.memmap)
+        '''
+        arrays = _memmap_npz(self.path(self.latest() if year is None else year))
+        meta = json.loads(str(arrays.pop('meta')))
+        return meta, arrays
+
+    def load(self, year=None, backend=None, **kwargs):
+        '''
+        Поднимает игру из контрольной точки, без запросов в хранилище игроков
+        :param year: какой год, None - последний
+        :param backend: хранилище игроков для следующих save, по умолчанию Django ORM
+        :param kwargs: autosave, metrics - как в Repository
+        :return: Repository
+        '''
+        from market import ScenarioTape
+        from repository import Repository, YearHistory
+        from schema import StateSchema
+
+        if year is None:
+            year = self.latest()
+        with np.load(self.path(year), allow_pickle=False) as file:
+            arrays = dict(file.items())
+        meta = json.loads(str(arrays['meta']))
+        data = pd.DataFrame({column: _unpack(arrays, f'column:{column}') for column in meta['columns']},
+                            index=pd.Index(_unpack(arrays, 'index'), name='id'))
+        history = YearHistory.from_arrays(data.index, meta['years'], arrays['history:choices'],
+                                          arrays['history:assets'], arrays['history:totals'],
+                                          arrays.get('history:state'))
+        repo = Repository.from_state(
+            data, meta['year'], meta['more_than_40'], history,
+            {field: arrays[f'saved:{field}'] for field in SAVED_FIELDS},
+            inflation_rate=meta['inflation'], educ_dohod=meta['educ_dohod'], engine=meta['engine'],
+            seed=meta['seed'], tape=None if meta['tape'] is None else ScenarioTape(meta['tape']),
+            schema=StateSchema(meta.get('float_dtype', 'float64'), meta.get('strict', False)),
+            backend=backend, checkpoints=self, **kwargs)
+        for year in meta.get('counterfactual_years', []):  # входы «что было бы» по сыгранным годам
+            repo.counterfactuals.record(year, RoundInputs(*(arrays[f'counterfactual:{year}:{field}']
+                                                            for field in RoundInputs.FIELDS)))
+        for year, players in meta.get('aggregate_rounds', []):  # выборы по раундам для aggregates
+            repo.aggregates.rounds[year] = RoundAggregates(arrays[f'aggregates:{year}:counts'],
+                                                           arrays[f'aggregates:{year}:invested'], players)
+        return repo
+
+
+def _pack(arrays, name, values):
+    '''
+    Числовая колонка пишется как есть, остальные - кодами в таблицу строковых значений (None/NaN - код -1).
+    У категориальной колонки (выборы, см. schema.py) коды и таблица берутся как есть
+    '''
+    values = pd.Series(values)
+    if values.dtype != object and not isinstance(values.dtype, pd.CategoricalDtype):
+        arrays[name] = values.to_numpy()
+        return
+    categorical = pd.Categorical(values)
+    arrays[name + ':codes'] = categorical.codes
+    categories = np.asarray(categorical.categories)
+    arrays[name + ':values'] = categories.astype(str) if categories.dtype == object else categories
+
+
+def _unpack(arrays, name):
+    if name in arrays:
+        return arrays[name]
+    values = arrays[name + ':values'].astype(object)
+    codes = arrays[name + ':codes']
+    column = np.empty(len(codes), dtype=object)
+    known = codes >= 0
+    column[known] = values[codes[known]]
+    return column
+
+
+def unpack_index(arrays):
+    return _unpack(arrays, 'index')
+
+
+def _memmap_npz(path):
+    '''
+    np.savez пишет архив без сжатия, поэтому каждый .npy внутри можно отобразить в память по его смещению
+    '''
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as file:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{path!r}: {info.filename} is compressed')
+            file.seek(info.header_offset + 26)  # длины имени и extra в локальном заголовке zip
+            name_length, extra_length = struct.unpack('<HH', file.read(4))
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+            name = info.filename[:-len('.npy')]
+            if not shape or 0 in shape:  # скаляры и пустые массивы читаются как есть
+                arrays[name] = np.fromfile(file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=file.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
@@ -0,0 +1,117 @@
+'''
+«Что было бы, если»: сколько принесла бы каждая опция каждому игроку в каждом активе за сыгранный раунд.
+Считается матрицей игроки × активы × опции на розыгрышах этого раунда и при тех же долях N_together/N_only,
+без повторных Gamble. Для того, что игрок выбрал на самом деле, в матрице стоит его настоящее начисление.
+
+Допущения для опций, которые игрок не выбирал:
+    sosed - матожидание монетки (1.05), своей монетки у игрока не было;
+    mortgage - NAKOP, если now - further на начало года больше числа начисленных ипотек игрока в предыдущих
+               активах; старый откат на банк (см. mortgage.py) - если проверка в этом активе еще не пройдена,
+               а у игрока нулевой mortgage_count или актив и так откатился из-за других игроков;
+    в раунде без seed и ленты опции, которые в активе никто не выбрал, не разыгрывались - для них берется
+    матожидание розыгрышей (market.EXPECTED_SHOCKS).
+'''
+from collections import OrderedDict
+
+import numpy as np
+
+from mortgage import MortgageLedger
+from repository import OPTION_CODES, OPTIONS
+
+
+class RoundInputs:
+    '''
+    То, что нужно запомнить после Gamble, чтобы потом посчитать матрицу. Все остальное берется из YearHistory
+    :param rates, coef, mortgage_rates: см. InvestingOptions.option_rates
+    :param educ: уровень образования на начало года - np.array
+    :param mortgage_count: mortgage_count на начало года - np.array
+    :param mortgage_gap: now_mortgage - further_mortgage на начало года - np.array
+    '''
+    FIELDS = ('rates', 'coef', 'mortgage_rates', 'educ', 'mortgage_count', 'mortgage_gap')  # порядок аргументов
+
+    def __init__(self, rates, coef, mortgage_rates, educ, mortgage_count, mortgage_gap):
+        self.rates = rates
+        self.coef = coef
+        self.mortgage_rates = mortgage_rates
+        self.educ = np.asarray(educ, dtype=np.int16)
+        self.mortgage_count = np.asarray(mortgage_count, dtype=np.int16)
+        self.mortgage_gap = np.asarray(mortgage_gap, dtype=np.int16)
+
+    @property
+    def nbytes(self):
+        return self.rates.nbytes + self.coef.nbytes + self.mortgage_rates.nbytes + self.educ.nbytes + \
+            self.mortgage_count.nbytes + self.mortgage_gap.nbytes
+
+
+class Counterfactuals:
+    '''
+    Входы по всем сыгранным раундам и готовые матрицы по последним keep запрошенным раундам (LRU)
+    :param educ_dohod: допдоход от образования, как в Repository
+    '''
+
+    def __init__(self, educ_dohod, keep=4):
+        self.educ_dohod = educ_dohod
+        self.keep = keep
+        self.rounds = {}  # год -> RoundInputs
+        self._cache = OrderedDict()  # год -> матрица
+
+    def record(self, year, inputs):
+        self.rounds[year] = inputs
+        self._cache.pop(year, None)  # переигровка года
+        return inputs
+
+    def matrix(self, year, history):
+        '''
+        :param history: YearHistory игры
+        :return: np.array (игроки × 3 × опции) - начисление по активу, в порядке OPTIONS
+        '''
+        if year in self._cache:
+            self._cache.move_to_end(year)
+            return self._cache[year]
+        try:
+            inputs = self.rounds[year]
+        except KeyError:
+            raise KeyError(f'no counterfactual inputs for year {year}')
+        matrix = self._compute(inputs, history.choices(year), history.assets(year), history.totals(year))
+        matrix.flags.writeable = False
+        self._cache[year] = matrix
+        while len(self._cache) > self.keep:
+            self._cache.popitem(last=False)
+        return matrix
+
+    def _compute(self, inputs, choices, assets, totals):
+        n = len(totals)
+        has_bonus = np.ones(len(OPTIONS))
+        has_bonus[OPTION_CODES['education']] = 0
+        bonus = totals * self.educ_dohod * inputs.educ
+        rates = np.broadcast_to(inputs.rates, (n, 3, len(OPTIONS))).copy()
+        rates[:, :, OPTION_CODES['mortgage']] = self._mortgage_rates(inputs, choices)
+        matrix = inputs.coef * (totals[:, None, None] * rates + bonus[:, None, None] * has_bonus)
+        players, slots = np.nonzero(choices < len(OPTIONS))
+        matrix[players, slots, choices[players, slots]] = assets[players, slots]
+        return matrix
+
+    @staticmethod
+    def _mortgage_rates(inputs, choices):
+        '''
+        :return: np.array (игроки × 3) - доходность ипотеки, если бы игрок выбрал ее в этом активе
+        '''
+        count = inputs.mortgage_count
+        chose = choices == OPTION_CODES['mortgage']
+        active = MortgageLedger(count, np.zeros_like(count), np.zeros_like(count)).check(chose)
+        accrued = chose & active
+        # k-я ипотека игрока за год - NAKOP, если k <= now - further
+        nakop = np.cumsum(accrued, axis=1) - accrued + 1 <= inputs.mortgage_gap[:, None]
+        rates = np.where(nakop, inputs.mortgage_rates[:, 0], inputs.mortgage_rates[:, 1])
+        if (count != 0).any():
+            first = int(np.argmax(active)) if active.any() else 3  # первый актив, где проверка прошла
+            pending = np.arange(3) <= first
+            failed = pending & ~active & chose.any(axis=0)
+            to_bank = pending & ((count == 0)[:, None] | failed)
+            rates = np.where(to_bank, inputs.rates[:, OPTION_CODES['bank']], rates)
+        return rates
+
+    @property
+    def nbytes(self):
+        return sum(inputs.nbytes for inputs in self.rounds.values()) + \
+            sum(matrix.nbytes for matrix in self._cache.values())
@@ -0,0 +1,106 @@
+'''
+Выгрузка результатов игры в длинном формате: одна строка на (игрок, год, актив). Строки идут пачками по
+chunk_size игроков через генератор, поэтому память не зависит от размера турнира. Читается YearHistory живой
+игры (сыгранные годы уже не меняются, замок игры не нужен) или контрольная точка через mmap:
+
+    for chunk in iter_chunks(repo): ...                    # pandas.DataFrame по chunk_size игроков
+    export(repo, 'game.csv')
+    export(CheckpointStore('/var/lib/freezy/game_12'), 'game.parquet')   # нужен pyarrow
+'''
+import numpy as np
+import pandas as pd
+
+from checkpoints import CheckpointStore, unpack_index
+from repository import CODE_NAMES, HISTORY_STATE
+
+COLUMNS = ('player', 'year', 'slot', 'choice', 'asset', 'total') + HISTORY_STATE
+
+
+def _source(source, year=None):
+    '''
+    :param source: Repository или checkpoints.CheckpointStore
+    :param year: для контрольной точки - какой год, None - последний
+    :return: (айди игроков, годы, выборы, активы, TOTAL, состояние) - массивы (игроки × годы [× ...])
+    '''
+    if isinstance(source, CheckpointStore):
+        meta, arrays = source.open(year)
+        state = arrays.get('history:state')
+        if state is None:
+            state = np.zeros(arrays['history:totals'].shape + (len(HISTORY_STATE),), dtype=np.int16)
+        return (unpack_index(arrays), meta['years'], arrays['history:choices'], arrays['history:assets'],
+                arrays['history:totals'], state)
+    history = source.history
+    k = len(history.years)  # снимок: следующий Gamble допишет год k, уже сыгранные не тронет
+    return (history.ids, list(history.years), history._choices[:, :k], history._assets[:, :k],
+            history._totals[:, :k], history._state[:, :k])
+
+
+def iter_chunks(source, year=None, chunk_size=10000):
+    '''
+    :return: генератор pandas.DataFrame с колонками COLUMNS
+    '''
+    ids, years, choices, assets, totals, state = _source(source, year)
+    years = np.asarray(years)
+    names = np.asarray(CODE_NAMES, dtype=object)
+    for start in range(0, len(ids), chunk_size):
+        stop = min(start + chunk_size, len(ids))
+        n = stop - start
+        shape = (n, len(years), 3)
+        chunk = {'player': np.broadcast_to(np.asarray(ids[start:stop])[:, None, None], shape).ravel(),
+                 'year': np.broadcast_to(years[None, :, None], shape).ravel(),
+                 'slot': np.broadcast_to(np.arange(1, 4)[None, None, :], shape).ravel(),
+                 'choice': names[np.asarray(choices[start:stop])].ravel(),
+                 'asset': np.asarray(assets[start:stop]).ravel(),
+                 'total': np.broadcast_to(np.asarray(totals[start:stop])[:, :, None], shape).ravel()}
+        for i, field in enumerate(HISTORY_STATE):
+            chunk[field] = np.broadcast_to(np.asarray(state[start:stop, :, i])[:, :, None], shape).ravel()
+        yield pd.DataFrame(chunk, columns=list(COLUMNS))
+
+
+def to_csv(source, path, year=None, chunk_size=10000):
+    '''
+    :return: число записанных строк
+    '''
+    rows = 0
+    with open(path, 'w', newline='') as file:
+        for i, chunk in enumerate(iter_chunks(source, year, chunk_size)):
+            chunk.to_csv(file, header=i == 0, index=False)
+            rows += len(chunk)
+    return rows
+
+
+def to_parquet(source, path, year=None, chunk_size=10000):
+    '''
+    Каждая пачка - отдельная row group. Нужен pyarrow
+    :return: число записанных строк
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('parquet export needs pyarrow: pip install pyarrow')
+    rows = 0
+    writer = None
+    try:
+        for chunk in iter_chunks(source, year, chunk_size):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export(source, path, year=None, chunk_size=10000):
+    '''
+    Формат по расширению: .csv или .parquet
+    :return: число записанных строк
+    '''
+    if path.endswith('.parquet'):
+        return to_parquet(source, path, year, chunk_size)
+    if path.endswith('.csv'):
+        return to_csv(source, path, year, chunk_size)
+    raise ValueError(f'unknown export format for {path!r}, expected .csv or .parquet')
@@ -0,0 +1,111 @@
+'''
+Прием выборов по одному игроку. Веб-слою больше не нужно копить все ответы и собирать списки в порядке Player:
+каждый ответ проверяется сразу и кладется на место игрока в массив кодов, счетчики по опциям ведутся на ходу.
+Когда ответили все (или вышел срок), раунд закрывается сам: неответившим ставится выбор по умолчанию,
+Choice и Gamble запускаются в фоне, результат - в RoundCollector.result (concurrent.futures.Future).
+'''
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from repository import OPTIONS, OPTION_CODES
+
+
+class RoundCollector:
+    '''
+    :param repo: Repository игры - из него берется список игроков
+    :param year: номер года, за который принимаются выборы
+    :param deadline: через сколько секунд закрыть раунд, даже если ответили не все; None - ждать всех
+    :param default: выбор по трем активам для тех, кто не ответил
+    :param play: функция (year, asset_1_choice, asset_2_choice, asset_3_choice) -> результат раунда,
+                 по умолчанию repo.Choice + repo.Gamble
+    '''
+
+    def __init__(self, repo, year, deadline=None, default=('bank', 'bank', 'bank'), play=None):
+        self.repo = repo
+        self.year = year
+        self.default = [self._code(option) for option in default]
+        self._play = play or self._play_repository
+        self.ids = list(repo.data.index)
+        self._position = {player_id: i for i, player_id in enumerate(self.ids)}
+        self._codes = np.full((len(self.ids), 3), -1, dtype=np.int8)  # -1 - игрок еще не ответил
+        self.counts = np.zeros((3, len(OPTIONS)), dtype=np.int64)  # выборы по активам и опциям
+        self.submitted = 0
+        self.closed = False
+        self.result = Future()
+        self._lock = threading.Lock()
+        self._timer = None
+        if deadline is not None:
+            self._timer = threading.Timer(deadline, self.close)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @staticmethod
+    def _code(option):
+        try:
+            return OPTION_CODES[option]
+        except (KeyError, TypeError):
+            raise ValueError(f'unknown option {option!r}')
+
+    def submit(self, player_id, year, asset_1_choice, asset_2_choice, asset_3_choice):
+        '''
+        Принять выбор игрока. Повторная отправка до закрытия раунда заменяет предыдущую
+        :return: True, если этим ответом раунд закрылся
+        '''
+        if year != self.year:
+            raise ValueError(f'round {self.year} is open, got a choice for year {year}')
+        codes = [self._code(option) for option in (asset_1_choice, asset_2_choice, asset_3_choice)]
+        with self._lock:
+            if self.closed:
+                raise RuntimeError(f'round {self.year} is already closed')
+            try:
+                i = self._position[player_id]
+            except KeyError:
+                raise ValueError(f'unknown player {player_id!r}')
+            previous = self._codes[i]
+            if previous[0] >= 0:
+                self.counts[[0, 1, 2], previous] -= 1
+            else:
+                self.submitted += 1
+            self._codes[i] = codes
+            self.counts[[0, 1, 2], codes] += 1
+            complete = self.submitted == len(self.ids)
+        if complete:
+            self.close()
+        return complete
+
+    def pending(self):
+        '''
+        :return: айдишники игроков, которые еще не ответили
+        '''
+        with self._lock:
+            return [self.ids[i] for i in np.flatnonzero(self._codes[:, 0] < 0)]
+
+    def close(self):
+        '''
+        Закрыть раунд: неответившим ставится default, Choice и Gamble запускаются в фоновом потоке
+        :return: Future с результатом раунда
+        '''
+        with self._lock:
+            if self.closed:
+                return self.result
+            self.closed = True
+            codes = self._codes.copy()
+        if self._timer is not None:
+            self._timer.cancel()
+        codes[codes[:, 0] < 0] = self.default
+        threading.Thread(target=self._run, args=(codes,), daemon=True).start()
+        return self.result
+
+    def _run(self, codes):
+        try:
+            names = np.asarray(OPTIONS, dtype=object)[codes]
+            self.result.set_result(self._play(self.year, names[:, 0].tolist(), names[:, 1].tolist(),
+                                              names[:, 2].tolist()))
+        except BaseException as e:
+            self.result.set_exception(e)
+
+    def _play_repository(self, year, asset_1_choice, asset_2_choice, asset_3_choice):
+        self.repo.Choice(year, asset_1_choice, asset_2_choice, asset_3_choice)
+        return self.repo.Gamble(year)
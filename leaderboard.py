@@ -0,0 +1,99 @@
+'''
+Рейтинг игроков в памяти. Пересобирается один раз за Gamble по новой колонке TOTAL, читатели берут неизменяемый
+снимок с номером версии, поэтому никогда не видят наполовину обновленный рейтинг.
+'''
+import threading
+from bisect import bisect_left
+
+
+class LeaderboardSnapshot:
+    '''
+    Неизменяемый рейтинг на один раунд. Места считаются с 1, при равенстве TOTAL выше тот, кто раньше в списке
+    :param version: номер версии (растет на 1 при каждой пересборке)
+    :param year: год, после которого собран рейтинг
+    '''
+
+    def __init__(self, version, year, ids, totals):
+        import numpy as np
+
+        order = np.argsort(-np.asarray(totals, dtype=float), kind='stable')
+        self.version = version
+        self.year = year
+        self.ids = np.asarray(ids)[order]
+        self.totals = np.asarray(totals, dtype=float)[order]
+        self._rank = {player_id: rank for rank, player_id in enumerate(self.ids.tolist(), start=1)}
+        self._ascending = (-self.totals).tolist()  # для бинарного поиска по сумме
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _rows(self, start, stop):
+        return [(rank, player_id, total) for rank, player_id, total in
+                zip(range(start + 1, stop + 1), self.ids[start:stop].tolist(), self.totals[start:stop].tolist())]
+
+    def top(self, k=10):
+        '''
+        :return: list из (место, айди игрока, TOTAL)
+        '''
+        return self._rows(0, min(k, len(self)))
+
+    def rank(self, player_id):
+        '''
+        :return: место игрока, None если такого нет
+        '''
+        return self._rank.get(player_id)
+
+    def rank_of_total(self, total):
+        '''
+        Какое место заняла бы такая сумма (бинарный поиск)
+        '''
+        return bisect_left(self._ascending, -total) + 1
+
+    def around(self, player_id, k=2):
+        '''
+        Игрок и по k соседей сверху и снизу
+        :return: list из (место, айди игрока, TOTAL)
+        '''
+        rank = self._rank.get(player_id)
+        if rank is None:
+            return []
+        return self._rows(max(rank - 1 - k, 0), min(rank + k, len(self)))
+
+
+class Leaderboard:
+    def __init__(self):
+        self.snapshot = None
+        self._lock = threading.Lock()  # пересборки идут по очереди, чтение снимка замка не требует
+
+    def rebuild(self, ids, totals, year=None):
+        '''
+        Собирает новый снимок и подменяет им текущий одним присваиванием
+        :param ids: айдишники игроков
+        :param totals: TOTAL по игрокам в том же порядке
+        :return: новый LeaderboardSnapshot
+        '''
+        with self._lock:
+            version = 0 if self.snapshot is None else self.snapshot.version + 1
+            snapshot = LeaderboardSnapshot(version, year, ids, totals)
+            self.snapshot = snapshot
+        return snapshot
+
+    def __getstate__(self):
+        return {'snapshot': self.snapshot}  # замок в pickle не попадает (SessionManager выгружает игры на диск)
+
+    def __setstate__(self, state):
+        self.snapshot = state['snapshot']
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return None if self.snapshot is None else self.snapshot.version
+
+    def top(self, k=10):
+        return self.snapshot.top(k)
+
+    def rank(self, player_id):
+        return self.snapshot.rank(player_id)
+
+    def around(self, player_id, k=2):
+        return self.snapshot.around(player_id, k)
@@ -0,0 +1,192 @@
+'''
+Розыгрыши рынка для InvestingOptions: купон корпоративных облигаций, шумы облигаций, индекса и ипотеки,
+выбор ветки индекса и монетки sosed.
+
+GlobalShocks - старое поведение, все берется из глобального np.random в момент обращения.
+SeededShocks - у каждой игры свой поток: np.random.Generator на каждый (seed игры, год, актив), все скалярные
+розыгрыши раунда делаются сразу пачкой. Игры не мешают друг другу, их можно считать в разных процессах,
+а любой раунд воспроизводится бит в бит по seed и году.
+ScenarioTape - те же розыгрыши, записанные заранее в файл на весь турнир (см. класс).
+'''
+import os
+
+import numpy as np
+
+KORP_BOND_COUPONS = (0.017, 0, 0.005)  # равновероятны
+# шумы с ограничениями (см. clipped_noise): имя -> (матожидание, стандартное отклонение)
+NOISES = {'korp_bond_noise': (0, 0.005),
+          'gov_bond_noise': (0, 0.005),
+          'stock_index_noise_1': (0.035, 0.0125),
+          'stock_index_noise_2': (0.015, 0.0125),
+          'mortgage_noise': (0, 0.01),
+          'mortgage_init_noise': (0, 0.01)}
+SHOCKS = ('korp_bond_coupon',) + tuple(NOISES) + ('stock_index_pick',)
+SOSED_WIN = 0.1
+
+
+def clipped_noise(rng, expected_value, std, size=None):
+    '''
+    Нормальный шум с ограничениями, как в InvestingOptions.make_random_noise: если |шум| больше
+    |матожидание + 3 std|, он заменяется на матожидание ± 3 std по знаку
+    :param rng: np.random.Generator или модуль np.random
+    :return: float при скалярных параметрах и size=None, иначе np.array
+    '''
+    noise = rng.normal(loc=expected_value, scale=std, size=size)
+    bound = np.abs(expected_value + 3 * std)
+    noise = np.where(np.abs(noise) > bound,
+                     np.where(noise < 0, expected_value - 3 * std, expected_value + 3 * std), noise)
+    return noise if noise.ndim else float(noise)
+
+
+# матожидания розыгрышей - для опций, которые в раунде без seed никто не выбрал и которые поэтому не разыгрывались.
+# У индекса обе ветки заменены средним смеси
+INDEX_MEAN = (NOISES['stock_index_noise_1'][0] + NOISES['stock_index_noise_2'][0]) / 2
+EXPECTED_SHOCKS = {name: mean for name, (mean, _) in NOISES.items()}
+EXPECTED_SHOCKS.update(korp_bond_coupon=sum(KORP_BOND_COUPONS) / len(KORP_BOND_COUPONS),
+                       stock_index_noise_1=INDEX_MEAN, stock_index_noise_2=INDEX_MEAN, stock_index_pick=0)
+
+
+class GlobalShocks:
+    '''
+    Розыгрыши из глобального np.random по одному, в том порядке, в котором их запрашивает движок
+    '''
+    replayable = False  # повторный draw дает новое значение
+
+    def draw(self, slot, name):
+        if name == 'korp_bond_coupon':
+            return np.random.choice(a=list(KORP_BOND_COUPONS), p=[1 / 3, 1 / 3, 1 / 3])
+        if name == 'stock_index_pick':
+            return np.random.choice(a=[0, 1], size=1, p=[1 / 2, 1 / 2])[0]
+        return clipped_noise(np.random, *NOISES[name])
+
+    def sosed(self, slot, size):
+        return np.random.choice(a=[SOSED_WIN, 0.0], size=size, p=[1 / 2, 1 / 2])
+
+
+class SeededShocks:
+    '''
+    Розыгрыши одного раунда одной игры
+    :param seed: seed игры - неотрицательное целое
+    :param year: номер года
+    '''
+    replayable = True
+
+    def __init__(self, seed, year):
+        self.seed = seed
+        self.year = year
+        self._rngs = [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(year, slot)))
+                      for slot in (1, 2, 3)]
+        means = np.array([mean for mean, _ in NOISES.values()])
+        stds = np.array([std for _, std in NOISES.values()])
+        self.values = np.empty((3, len(SHOCKS)))  # актив × SHOCKS
+        for rng, row in zip(self._rngs, self.values):
+            row[0] = KORP_BOND_COUPONS[rng.integers(len(KORP_BOND_COUPONS))]
+            row[1:-1] = clipped_noise(rng, means, stds)
+            row[-1] = rng.integers(2)
+        self._index = {name: i for i, name in enumerate(SHOCKS)}
+
+    def draw(self, slot, name):
+        return self.values[slot - 1, self._index[name]]
+
+    def sosed(self, slot, size):
+        '''
+        Монетки sosed берутся из потока актива после скалярных розыгрышей, sosed разыгрывается не больше раза за актив
+        '''
+        return np.where(self._rngs[slot - 1].random(size) < 1 / 2, SOSED_WIN, 0.0)
+
+
+TAPE_DTYPE = [(name, '<f8') for name in SHOCKS] + [('sosed_seed', '<u8')]
+
+
+class ScenarioTape:
+    '''
+    Заранее разыгранный рынок на турнир: таблица год × актив с розыгрышами SHOCKS и seed для монеток sosed.
+    Пишется один раз (write) в .npy, читается через mmap только на чтение - один файл на любое число игр и
+    процессов, и во всех классах рынок одинаковый. Доли stock_together/stock_only по-прежнему считаются
+    по выборам игроков в самой игре.
+    :param path: путь к файлу ленты
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.table = np.load(path, mmap_mode='r')  # строка года year - table[year - 1]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getstate__(self):
+        return {'path': self.path}  # в pickle только путь, при загрузке файл открывается заново
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @staticmethod
+    def write(path, years, seed):
+        '''
+        Разыгрывает рынок на years лет. Скалярные розыгрыши (SHOCKS) те же, что у SeededShocks(seed, year),
+        а монетки sosed - нет: у ленты они из своего SeedSequence(seed, spawn_key=(year, актив, 1)),
+        SeededShocks же берет их из потока актива после скалярных розыгрышей
+        :return: ScenarioTape на записанный файл
+        '''
+        table = np.zeros((years, 3), dtype=TAPE_DTYPE)
+        for year in range(1, years + 1):
+            shocks = SeededShocks(seed, year)
+            for i, name in enumerate(SHOCKS):
+                table[name][year - 1] = shocks.values[:, i]
+            for slot in (1, 2, 3):
+                table['sosed_seed'][year - 1, slot - 1] = np.random.SeedSequence(
+                    seed, spawn_key=(year, slot, 1)).generate_state(1, np.uint64)[0]
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as file:
+            np.save(file, table)
+        os.replace(tmp, path)
+        return ScenarioTape(path)
+
+    def shocks(self, year):
+        if not 1 <= year <= len(self):
+            raise ValueError(f'tape {self.path!r} covers years 1..{len(self)}, got {year}')
+        return TapeShocks(self.table[year - 1])
+
+
+class TapeShocks:
+    '''
+    Розыгрыши одного года из ScenarioTape
+    '''
+    replayable = True
+
+    def __init__(self, row):
+        self.row = row
+
+    def draw(self, slot, name):
+        return float(self.row[slot - 1][name])
+
+    def sosed(self, slot, size):
+        rng = np.random.default_rng(int(self.row[slot - 1]['sosed_seed']))
+        return np.where(rng.random(size) < 1 / 2, SOSED_WIN, 0.0)
+
+
+class RecordedShocks:
+    '''
+    Обертка над розыгрышами раунда, которая запоминает все, что выпало. В режиме replay отдает уже выпавшие
+    значения, не трогая генератор: для повторяемых источников - их же значения, для глобального np.random -
+    запомненные или EXPECTED_SHOCKS
+    '''
+
+    def __init__(self, shocks):
+        self.shocks = shocks
+        self.drawn = {}  # (актив, имя) -> значение
+        self.replay = False
+
+    def draw(self, slot, name):
+        if self.replay:
+            if (slot, name) in self.drawn:
+                return self.drawn[slot, name]
+            if self.shocks.replayable:
+                return self.shocks.draw(slot, name)
+            return EXPECTED_SHOCKS[name]
+        value = self.shocks.draw(slot, name)
+        self.drawn[slot, name] = value
+        return value
+
+    def sosed(self, slot, size):
+        return self.shocks.sosed(slot, size)
@@ -0,0 +1,157 @@
+'''
+Метрики движка: время по опциям и активам, число игроков на опцию, откаты на банк с причиной, N_together/N_only.
+Если Repository создан без metrics, движок не делает ничего, кроме одной проверки на None.
+
+    metrics = EngineMetrics()
+    repo = Repository(..., metrics=metrics)
+    ...
+    metrics.rounds[-1].as_dict()   # последний раунд
+    metrics.prometheus()           # текст в формате Prometheus
+    serve_metrics(metrics, 9100)   # тот же текст по http://host:9100/metrics
+'''
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RoundMetrics:
+    '''
+    Метрики одного Gamble
+    '''
+
+    def __init__(self, year, n_together=None, n_only=None):
+        self.year = year
+        self.n_together = n_together
+        self.n_only = n_only
+        self.seconds = 0.0
+        self.slot_seconds = {}  # актив -> сек
+        self.option_seconds = {}  # (актив, опция) -> сек
+        self.option_players = {}  # (актив, опция) -> число игроков
+        self.fallbacks = []  # (актив, опция, число игроков, причина)
+
+    def add_option(self, slot, option, seconds, players):
+        key = (slot, option)
+        self.option_seconds[key] = self.option_seconds.get(key, 0.0) + seconds
+        self.option_players[key] = self.option_players.get(key, 0) + players
+
+    def add_fallback(self, slot, option, players, error):
+        self.fallbacks.append((slot, option, players, f'{type(error).__name__}: {error}'))
+
+    def as_dict(self):
+        return {'year': self.year, 'n_together': self.n_together, 'n_only': self.n_only,
+                'seconds': self.seconds,
+                'slot_seconds': {str(slot): seconds for slot, seconds in self.slot_seconds.items()},
+                'options': [{'slot': slot, 'option': option, 'seconds': seconds,
+                             'players': self.option_players.get((slot, option), 0)}
+                            for (slot, option), seconds in self.option_seconds.items()],
+                'fallbacks': [{'slot': slot, 'option': option, 'players': players, 'reason': reason}
+                              for slot, option, players, reason in self.fallbacks]}
+
+
+class EngineMetrics:
+    '''
+    Накопитель по раундам, можно делить между несколькими играми
+    :param keep_rounds: сколько последних RoundMetrics хранить целиком
+    '''
+
+    def __init__(self, keep_rounds=100):
+        self.rounds = deque(maxlen=keep_rounds)
+        self.rounds_total = 0
+        self.seconds_total = 0.0
+        self.slot_seconds = {}
+        self.option_seconds = {}
+        self.option_players = {}
+        self.fallbacks = {}  # (опция, тип ошибки) -> число откатов
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']  # замок в pickle не попадает
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def round(self, year, n_together=None, n_only=None):
+        return RoundMetrics(year, n_together, n_only)
+
+    def record(self, round_metrics):
+        with self._lock:
+            self.rounds.append(round_metrics)
+            self.rounds_total += 1
+            self.seconds_total += round_metrics.seconds
+            for slot, seconds in round_metrics.slot_seconds.items():
+                self.slot_seconds[slot] = self.slot_seconds.get(slot, 0.0) + seconds
+            for key, seconds in round_metrics.option_seconds.items():
+                self.option_seconds[key] = self.option_seconds.get(key, 0.0) + seconds
+                self.option_players[key] = self.option_players.get(key, 0) + round_metrics.option_players[key]
+            for _, option, _, reason in round_metrics.fallbacks:
+                key = (option, reason.split(':', 1)[0])
+                self.fallbacks[key] = self.fallbacks.get(key, 0) + 1
+        return round_metrics
+
+    def prometheus(self):
+        '''
+        :return: все накопленные метрики текстом в формате Prometheus
+        '''
+        with self._lock:
+            last = self.rounds[-1] if self.rounds else None
+            lines = ['# TYPE freezy_gamble_rounds_total counter',
+                     f'freezy_gamble_rounds_total {self.rounds_total}',
+                     '# TYPE freezy_gamble_seconds_total counter',
+                     f'freezy_gamble_seconds_total {self.seconds_total}',
+                     '# TYPE freezy_slot_seconds_total counter']
+            lines += [f'freezy_slot_seconds_total{{slot="{slot}"}} {seconds}'
+                      for slot, seconds in sorted(self.slot_seconds.items())]
+            lines.append('# TYPE freezy_option_seconds_total counter')
+            lines += [f'freezy_option_seconds_total{{slot="{slot}",option="{_label(option)}"}} {seconds}'
+                      for (slot, option), seconds in sorted(self.option_seconds.items(), key=_key)]
+            lines.append('# TYPE freezy_option_players_total counter')
+            lines += [f'freezy_option_players_total{{slot="{slot}",option="{_label(option)}"}} {players}'
+                      for (slot, option), players in sorted(self.option_players.items(), key=_key)]
+            lines.append('# TYPE freezy_bank_fallback_total counter')
+            lines += [f'freezy_bank_fallback_total{{option="{_label(option)}",reason="{reason}"}} {count}'
+                      for (option, reason), count in sorted(self.fallbacks.items(), key=_key)]
+            if last is not None:
+                lines += ['# TYPE freezy_last_round_seconds gauge',
+                          f'freezy_last_round_seconds {last.seconds}',
+                          '# TYPE freezy_last_n_together gauge',
+                          f'freezy_last_n_together {last.n_together}',
+                          '# TYPE freezy_last_n_only gauge',
+                          f'freezy_last_n_only {last.n_only}']
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _key(item):
+    return tuple(map(str, item[0]))
+
+
+def serve_metrics(metrics, port, host=''):
+    '''
+    Отдает metrics.prometheus() по GET /metrics в фоновом потоке
+    :return: ThreadingHTTPServer (остановить - server.shutdown())
+    '''
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,83 @@
+'''
+Счетчики ипотеки игроков. Раньше движок гонял mortgage/accrue_mortgage/checker_for_mortgage по слотам и
+двигал счетчики через индексы датафрейма; здесь это три целочисленных массива и явные переходы за год,
+которые считаются сразу для всех трех активов.
+
+Переходы для одного выбора ипотеки (d = now - further):
+    d >= 1 -> NAKOP (доходность 1.07): count -1, now -1
+    d <= 0 -> START (доходность 1.03): count +1, further +1
+Каждый выбор уменьшает d на 1, поэтому k-я ипотека игрока за год - NAKOP тогда и только тогда, когда k <= d
+на начало года. После года Gamble переносит further в now.
+
+Проверка checker_for_mortgage срабатывает до первого начисления ипотеки, поэтому всегда видит счетчики начала
+года. Ее старое поведение сохранено: если у кого-то в игре mortgage_count != 0, а среди выбравших ипотеку
+в активе есть игрок с нулем, pandas падал с KeyError - ипотека в этом активе уходила в банк, а проверка
+повторялась на следующем активе с ипотекой.
+'''
+import numpy as np
+
+NONE, START, NAKOP = 0, 1, 2
+
+
+class MortgageLedger:
+    '''
+    :param count, further, now: mortgage_count, further_mortgage, now_mortgage по игрокам
+    '''
+    COLUMNS = ('mortgage_count', 'further_mortgage', 'now_mortgage')
+
+    def __init__(self, count, further, now):
+        self.count = np.array(count, dtype=np.int32)
+        self.further = np.array(further, dtype=np.int32)
+        self.now = np.array(now, dtype=np.int32)
+
+    @classmethod
+    def from_frame(cls, data):
+        return cls(*(data[name].to_numpy() for name in cls.COLUMNS))
+
+    def to_frame(self, data):
+        '''
+        Записывает счетчики обратно в датафрейм, тип колонок не меняется
+        '''
+        for name, values in zip(self.COLUMNS, (self.count, self.further, self.now)):
+            data[name] = values.astype(data[name].dtype, copy=False)
+        return data
+
+    def check(self, chose):
+        '''
+        Векторный checker_for_mortgage по всем трем активам
+        :param chose: (игроки × 3) bool - кто в каком активе выбрал ипотеку
+        :return: np.array из 3 bool - в каких активах ипотека начисляется (False - откат на банк или никто
+                 не выбрал)
+        '''
+        active = chose.any(axis=0)
+        nonzero = self.count != 0
+        if not nonzero.any():
+            return active
+        for slot in range(chose.shape[1]):
+            if not active[slot]:
+                continue
+            players_ = chose[:, slot]
+            if nonzero[players_].all():
+                count_second_choice = chose.sum(axis=1)[players_]
+                self.count[players_] = np.minimum(self.count[players_], count_second_choice)
+                return active
+            active[slot] = False
+        return active
+
+    def settle(self, chose):
+        '''
+        Переходы за год сразу по всем активам
+        :param chose: (игроки × 3) bool - кто в каком активе выбрал ипотеку
+        :return: (active - см. check, states - (игроки × 3) int8 из NONE/START/NAKOP)
+        '''
+        chose = np.asarray(chose, dtype=bool)
+        active = self.check(chose)
+        accrued = chose & active
+        nakop = accrued & (np.cumsum(accrued, axis=1) <= (self.now - self.further)[:, None])
+        n_nakop = nakop.sum(axis=1, dtype=np.int32)
+        n_start = accrued.sum(axis=1, dtype=np.int32) - n_nakop
+        self.count += n_start - n_nakop
+        self.further += n_start
+        self.now -= n_nakop
+        states = np.where(nakop, NAKOP, np.where(accrued, START, NONE)).astype(np.int8)
+        return active, states
@@ -0,0 +1,236 @@
+'''
+Хранилища игроков для Repository. Движок (InvestingOptions, Repository.Choice/Gamble) про Django ничего не знает:
+все чтение и запись состояния игроков идет через бэкенд. Django поднимается только при первом обращении
+к DjangoBackend, поэтому воркеры, тесты и симуляции импортируют движок без него.
+'''
+import os
+import sqlite3
+import sys
+
+# поля модели Game.models.Player, которые нужны движку
+PLAYER_FIELDS = ('ID', 'Name', 'Active_a', 'Active_b', 'Active_c',
+                 'Mortgage_count', 'Further_mortgage', 'Now_mortgage', 'Education')
+NUMERIC_FIELDS = PLAYER_FIELDS[2:]
+
+_django_models = None
+_default_backend = None
+
+
+def django_models():
+    '''
+    Ленивая инициализация Django-проекта finalGame
+    :return: модуль Game.models
+    '''
+    global _django_models
+    if _django_models is None:
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        project_dir = dir_path[:-16] + '/finalGame'
+        sys.path.append(project_dir)
+        os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+        import django
+
+        django.setup()
+
+        from Game import models
+        _django_models = models
+    return _django_models
+
+
+def get_default_backend():
+    '''
+    Бэкенд, который используют Repository и Factory, если им не передали свой. По умолчанию - Django ORM
+    '''
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = DjangoBackend()
+    return _default_backend
+
+
+def set_default_backend(backend):
+    global _default_backend
+    _default_backend = backend
+    return backend
+
+
+class Backend:
+    '''
+    Интерфейс хранилища игроков
+    '''
+
+    def load_players(self):
+        '''
+        :return: dict колонок - PLAYER_FIELDS + 'TOTAL' (сумма активов), по одному значению на игрока
+        '''
+        raise NotImplementedError
+
+    def current_year(self):
+        '''
+        :return: номер текущего года игры (день в админке минус 2)
+        '''
+        raise NotImplementedError
+
+    def ranked_players(self):
+        '''
+        :return: игроки по убыванию суммы активов
+        '''
+        raise NotImplementedError
+
+    def save_players(self, columns, batch_size=500):
+        '''
+        Запись состояния игроков одной транзакцией
+        :param columns: dict колонок - 'ID' и любые из NUMERIC_FIELDS
+        :param batch_size: размер пачки для bulk-запросов
+        :return: число записанных игроков
+        '''
+        raise NotImplementedError
+
+
+class DjangoBackend(Backend):
+    @property
+    def models(self):
+        return django_models()
+
+    def load_players(self):
+        '''
+        Один запрос values_list вместо обхода объектов модели. TOTAL считается как Active_a + Active_b + Active_c,
+        так же как в ranked_players
+        '''
+        Player = self.models.Player
+        rows = list(Player.objects.values_list(*PLAYER_FIELDS))
+        if not rows:
+            test_user = Player(Name='TestUser')
+            rows = [tuple(getattr(test_user, field) for field in PLAYER_FIELDS)]
+        return _columns(rows)
+
+    def current_year(self):
+        Admin = self.models.Admin
+        aa = Admin.objects.all()
+        if len(aa) == 0:
+            Admin(Day=2).save()
+            return 0
+        return list(aa)[-1:][0].Day - 2
+
+    def ranked_players(self):
+        from django.db.models import F
+
+        return self.models.Player.objects.annotate(s=F('Active_a') + F('Active_b') + F('Active_c')).order_by('-s')
+
+    def save_players(self, columns, batch_size=500):
+        from django.db import transaction
+
+        Player = self.models.Player
+        fields = [field for field in columns if field != 'ID']
+        ids = list(columns['ID'])
+        position = {player_id: i for i, player_id in enumerate(ids)}
+        with transaction.atomic():
+            for start in range(0, len(ids), batch_size):
+                players = list(Player.objects.filter(ID__in=ids[start:start + batch_size]))
+                for player in players:
+                    i = position[player.ID]
+                    for field in fields:
+                        setattr(player, field, columns[field][i])
+                Player.objects.bulk_update(players, fields, batch_size=batch_size)
+        return len(ids)
+
+
+class MemoryBackend(Backend):
+    '''
+    Игроки хранятся в памяти процесса списком dict-ов с полями PLAYER_FIELDS. Для локальных прогонов и симуляций
+    '''
+
+    def __init__(self, players=None, day=None):
+        self.players = []
+        self.day = day
+        for player in players or []:
+            self.add_player(**player)
+
+    def add_player(self, **fields):
+        player = {field: 0 for field in NUMERIC_FIELDS}
+        player['ID'] = len(self.players) + 1
+        player['Name'] = ''
+        player.update(fields)
+        self.players.append(player)
+        return player
+
+    def load_players(self):
+        if not self.players:
+            return _columns([(None, 'TestUser') + (0,) * len(NUMERIC_FIELDS)])
+        return _columns([tuple(player[field] for field in PLAYER_FIELDS) for player in self.players])
+
+    def current_year(self):
+        if self.day is None:
+            self.day = 2
+            return 0
+        return self.day - 2
+
+    def ranked_players(self):
+        return sorted(self.players, key=lambda player: player['Active_a'] + player['Active_b'] + player['Active_c'],
+                      reverse=True)
+
+    def save_players(self, columns, batch_size=500):
+        by_id = {player['ID']: player for player in self.players}
+        fields = [field for field in columns if field != 'ID']
+        for i, player_id in enumerate(columns['ID']):
+            player = by_id[player_id]
+            for field in fields:
+                player[field] = columns[field][i]
+        return len(columns['ID'])
+
+
+class SQLiteBackend(Backend):
+    '''
+    Таблицы players и admin в файле SQLite (или в памяти при path=':memory:') с теми же полями, что и в Django
+    '''
+
+    def __init__(self, path=':memory:'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS players (ID INTEGER PRIMARY KEY, Name TEXT, '
+                                + ', '.join(f'{field} {"REAL" if field.startswith("Active") else "INTEGER"} DEFAULT 0'
+                                            for field in NUMERIC_FIELDS) + ')')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS admin (id INTEGER PRIMARY KEY, Day INTEGER)')
+        self.connection.commit()
+
+    def add_player(self, **fields):
+        fields.setdefault('Name', '')
+        names = ', '.join(fields)
+        marks = ', '.join('?' for _ in fields)
+        with self.connection:
+            cursor = self.connection.execute(f'INSERT INTO players ({names}) VALUES ({marks})', list(fields.values()))
+        return cursor.lastrowid
+
+    def load_players(self):
+        rows = self.connection.execute(f'SELECT {", ".join(PLAYER_FIELDS)} FROM players ORDER BY ID').fetchall()
+        if not rows:
+            rows = [(None, 'TestUser') + (0,) * len(NUMERIC_FIELDS)]
+        return _columns(rows)
+
+    def current_year(self):
+        row = self.connection.execute('SELECT Day FROM admin ORDER BY id DESC LIMIT 1').fetchone()
+        if row is None:
+            with self.connection:
+                self.connection.execute('INSERT INTO admin (Day) VALUES (2)')
+            return 0
+        return row[0] - 2
+
+    def ranked_players(self):
+        cursor = self.connection.execute(f'SELECT {", ".join(PLAYER_FIELDS)} FROM players '
+                                         'ORDER BY Active_a + Active_b + Active_c DESC')
+        return [dict(zip(PLAYER_FIELDS, row)) for row in cursor.fetchall()]
+
+    def save_players(self, columns, batch_size=500):
+        fields = [field for field in columns if field != 'ID']
+        query = f'UPDATE players SET {", ".join(f"{field} = ?" for field in fields)} WHERE ID = ?'
+        rows = list(zip(*(columns[field] for field in fields), columns['ID']))
+        with self.connection:
+            for start in range(0, len(rows), batch_size):
+                self.connection.executemany(query, rows[start:start + batch_size])
+        return len(rows)
+
+
+def _columns(rows):
+    '''
+    Строки (в порядке PLAYER_FIELDS) -> dict колонок с добавленным TOTAL
+    '''
+    columns = {field: list(values) for field, values in zip(PLAYER_FIELDS, zip(*rows))}
+    columns['TOTAL'] = [a + b + c for a, b, c in zip(columns['Active_a'], columns['Active_b'], columns['Active_c'])]
+    return columns
@@ -1,54 +1,179 @@
-import csv, sys, os
-import os
+from __future__ import annotations
+
+import re
+import importlib
+import numbers
+import itertools
+import time
 from datetime import datetime
 import logging
 
-from django.db.models import F
+from persistence import get_default_backend, django_models
+from sessions import SessionManager
+from leaderboard import Leaderboard
+from cache import ResponseCache
+
+
+class _LazyImport:
+    '''
+    Модуль, который импортируется при первом обращении к атрибуту: pandas и numpy грузятся только тогда,
+    когда движок действительно считает, а не при импорте repository
+    '''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
 
-dir_path = os.path.dirname(os.path.realpath(__file__))
-project_dir = dir_path[:-16] + '/finalGame'
-sys.path.append(project_dir)
-os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
-import django
 
-django.setup()
+pd = _LazyImport('pandas')
+np = _LazyImport('numpy')
+market = _LazyImport('market')
 
-from Game.models import Player, Factor, Admin
+logger = logging.getLogger(__name__)
+_generations = itertools.count()  # поколения состояния игр, общие на процесс - см. Repository.generation
 
 
 class History():  # на страничку статистики выдается лист из историй конкретного юзера. В каждой: год,выбор, доходность
-    def __init__(self, year, person, act_a, act_b, increase_a, increase_b):
+    def __init__(self, year, person, act_a, act_b, increase_a, increase_b, act_c=None, increase_c=None):
         self.year = year
         self.person = person
         self.act_a = act_a
         self.act_b = act_b
         self.increase_a = increase_a
         self.increase_b = increase_b
+        self.act_c = act_c
+        self.increase_c = increase_c
 
 
 class Factory:
-    def __init__(self):
-        self.repo = None
+    def __init__(self, backend=None, max_games=None, max_bytes=None, spill_dir=None, cache_entries=4096,
+                 backend_for=None):
+        '''
+        :param backend: хранилище игроков, если игра одна (в Player нет поля игры: одно хранилище - одна игра)
+        :param backend_for: функция game_id -> хранилище игроков этой игры, чтобы вести несколько игр,
+                            например lambda game_id: SQLiteBackend(f'/var/lib/freezy/{game_id}.sqlite')
+        :param max_games, max_bytes: лимиты на живые игры в памяти, см. sessions.SessionManager
+        :param cache_entries: размер кеша ответов get_top/get_history/get_stats, см. cache.ResponseCache
+        '''
+        self.repo = None  # последняя выданная игра (sessions.GameHandle)
+        self.backend = backend
+        self.backend_for = backend_for
+        self.sessions = SessionManager(self._create_repository, max_games=max_games, max_bytes=max_bytes,
+                                       spill_dir=spill_dir)
+        self.cache = ResponseCache(cache_entries)
+
+    def _create_repository(self, id_, flag_40=None, seed=None, tape=None):
+        backend = self.backend_for(id_) if self.backend_for is not None else self.backend
+        return Repository(id_, more_than_40 = flag_40, backend=backend, seed=seed, tape=tape)
 
-    def get_repository(self, id_, flag_40=None):
-        self.repo = self.repo or Repository(id_, more_than_40 = flag_40)
+    def get_repository(self, id_, flag_40=None, seed=None, tape=None):
+        '''
+        :param id_: айди игры
+        :param flag_40: more_than_40 для новой игры
+        :param seed, tape: источник розыгрышей для новой игры, см. Repository
+        :return: sessions.GameHandle - ведет себя как Repository, но каждое обращение идет под замком игры
+        '''
+        self.repo = self.sessions.get(id_, flag_40=flag_40, seed=seed, tape=tape)
         return self.repo
 
+    def get_leaderboard(self, id_):
+        '''
+        Рейтинг игры из памяти, без запроса в базу
+        :return: leaderboard.LeaderboardSnapshot
+        '''
+        return self.sessions.get(id_).leaderboard.snapshot
+
+    def cached(self, id_, request, compute):
+        '''
+        Ответ из кеша текущего поколения игры; при промахе compute(repo) считается один раз под замком игры
+        :param request: hashable ключ запроса
+        '''
+        generation = self.sessions.generation(id_)
+
+        def fill():
+            with self.sessions.session(id_) as repo:
+                return compute(repo)
+
+        return self.cache.get(id_, generation, request, fill)
+
+    def get_top(self, id_, k=10):
+        '''
+        :return: list из (место, айди игрока, TOTAL)
+        '''
+        return self.cached(id_, ('top', k), lambda repo: repo.leaderboard.top(k))
+
+    def get_history(self, id_, player_id):
+        '''
+        :return: list из History игрока для странички статистики
+        '''
+        return self.cached(id_, ('history', player_id), lambda repo: repo.get_history(player_id))
+
+    def get_stats(self, id_):
+        '''
+        :return: aggregates.GameAggregates.summary() игры
+        '''
+        return self.cached(id_, ('stats',), lambda repo: repo.aggregates.summary())
+
     @staticmethod
-    def get_players():
-        return Player.objects.annotate(s=F('Active_a') + F('Active_b') + F('Active_c')).order_by('-s')
+    def get_players(backend=None):
+        return (backend or get_default_backend()).ranked_players()
 
     #
     # def delete_repo(self):
     #     self.repo = None
     @staticmethod
     def get_notreal_players():
+        Player = django_models().Player
         return [Player(Name='test1', ID=1), Player(Name='test2', ID=2),
                 Player(Name='test3', ID=3), Player(Name='test4', ID=4), Player(Name='test5', ID=5)]
 
 
-import pandas as pd
-import numpy as np
+# таблица кодов инвестиционных опций для векторного режима начисления
+OPTIONS = ('bank', 'sosed', 'korp_bond', 'gov_bond', 'stock_together',
+           'stock_only', 'stock_index', 'mortgage', 'education')
+OPTION_CODES = {name: code for code, name in enumerate(OPTIONS)}
+UNKNOWN_CODE = len(OPTIONS)  # неизвестная опция - начисляем как банк
+MISSING_CODE = len(OPTIONS) + 1  # пропуск (NaN/None) - актив остается нулевым
+CODE_NAMES = OPTIONS + ('unknown', None)  # обратная таблица для кодов, включая UNKNOWN_CODE и MISSING_CODE
+# колонки, привязанные к году: asset_{год}_{актив}, year_{год}_{актив}, TOTAL_year_{год}_for_dohod и т.д.
+# состояние игрока после года, которое хранит YearHistory
+HISTORY_STATE = ('educ', 'mortgage_count', 'now_mortgage')
+YEAR_COLUMN = re.compile(r'^(?:asset|year|TOTAL_year)_(-?\d+)(?:_\d)?(?:_for_dohod)?$')
+
+
+def _check_seed(seed):
+    '''
+    :return: seed игры как int (np.int64 и т.п. приводятся), None остается None
+    '''
+    if seed is None:
+        return None
+    if isinstance(seed, bool) or not isinstance(seed, numbers.Integral) or seed < 0:
+        raise ValueError(f'seed must be a non-negative integer, got {seed!r}')
+    return int(seed)
+
+
+def encode_choices(column) -> np.ndarray:
+    '''
+    Перевод колонки с выборами игроков в целочисленные коды по таблице OPTIONS
+    :param column: выборы игроков за год по одному активу - pd.Series / np.array / list
+    :return: коды выборов - np.array
+    '''
+    from schema import CHOICE_DTYPE
+
+    if getattr(column, 'dtype', None) == CHOICE_DTYPE:  # коды категорий и есть коды OPTIONS (см. schema.py)
+        codes = np.array(column.cat.codes if isinstance(column, pd.Series) else column.codes, dtype=np.int8)
+        codes[codes == -1] = MISSING_CODE
+        return codes
+    values = pd.Series(column, dtype=object).to_numpy()
+    codes = pd.Categorical(values, categories=OPTIONS).codes.astype(np.int8)
+    codes[codes == -1] = UNKNOWN_CODE
+    codes[pd.isna(values)] = MISSING_CODE
+    return codes
 
 
 class InvestingOptions:
@@ -60,7 +185,8 @@ class InvestingOptions:
 
     def __init__(self, df: pd.DataFrame, year: int, educ_dohod: float,
                  inflation_rate: float, number_only: float,
-                 number_together: float, was_more_than_40: bool):
+                 number_together: float, was_more_than_40: bool, engine: str = 'vector', metrics=None,
+                 shocks=None):
         self.data = df  # датафрейм с информацией по текущей игре
         self.choice_1 = "year_" + str(year) + '_1'
         self.choice_2 = "year_" + str(year) + '_2'
@@ -74,8 +200,15 @@ class InvestingOptions:
         self.stock_together_ratio = number_together  # коэффициент участников для акции роста
         self.year = year
         self.was_more_than_40 = was_more_than_40
+        self.was_more_than_40_start = was_more_than_40  # was_more_than_40 меняется по ходу accrue
         self.checker = False
         self.first_check_mortgage = True
+        self.codes = None  # коды выборов по трем активам, заполняются в векторном режиме
+        self.engine = engine  # 'vector' - однопроходный режим, 'loop' - старый проход по опциям через .loc
+        self.metrics = metrics  # metrics.RoundMetrics текущего раунда или None, если метрики выключены
+        # розыгрыши рынка (market.SeededShocks), None - глобальный np.random, как раньше; все выпавшее запоминается
+        self.shocks = market.RecordedShocks(shocks if shocks is not None else market.GlobalShocks())
+        self.slot = None  # актив, который сейчас начисляется - по нему берутся розыгрыши из shocks
 
     def bank(self, indexes,
              mon_fut, flag=0):
@@ -106,20 +239,29 @@ class InvestingOptions:
 
     def korp_bond(self, indexes,
                   mon_fut, flag=0):
-        scalar_value = np.random.choice(a=[0.017, 0, 0.005], p=[1 / 3, 1 / 3, 1 / 3])
-        noise = self.make_random_noise(0, 0.005)
-        self.data.loc[indexes, mon_fut] = (1 / 3) * (self.data.loc[indexes, "TOTAL"] * ( \
-        1 + scalar_value + self.inflat + noise) + \
+        return_rate = self._korp_bond_rate()
+        self.data.loc[indexes, mon_fut] = (1 / 3) * (self.data.loc[indexes, "TOTAL"] * return_rate + \
         self.data.loc[indexes, "TOTAL"] * self.educ * flag *self.data.loc[indexes, 'educ'])
         return self
 
+    def _shock(self, name):
+        return self.shocks.draw(self.slot, name)
+
+    def _korp_bond_rate(self):
+        scalar_value = self._shock('korp_bond_coupon')
+        noise = self._shock('korp_bond_noise')
+        return 1 + scalar_value + self.inflat + noise
+
     def gov_bond(self, indexes, mon_fut, flag=0):
-        noise = self.make_random_noise(0, 0.005)
-        self.data.loc[indexes, mon_fut] = (1 / 3) * (self.data.loc[indexes, "TOTAL"] * \
-        (1 + self.inflat + 0.005 + noise) + \
+        return_rate = self._gov_bond_rate()
+        self.data.loc[indexes, mon_fut] = (1 / 3) * (self.data.loc[indexes, "TOTAL"] * return_rate + \
         flag * self.data.loc[indexes, "TOTAL"] * self.educ * self.data.loc[indexes, 'educ'])
         return self
 
+    def _gov_bond_rate(self):
+        noise = self._shock('gov_bond_noise')
+        return 1 + self.inflat + 0.005 + noise
+
     def education(self, indexes, mon_fut):
         # поставь ограничение на 8-ой уровень образования
         self.data.loc[indexes, 'educ'] += 1
@@ -128,6 +270,12 @@ class InvestingOptions:
         return self
 
     def stock_only(self, indexes, mon_fut, flag=0):
+        market_premium = self._stock_only_premium()
+        self.data.loc[indexes, mon_fut] = 0.33 * (self.data.loc[indexes, "TOTAL"] * (1 + market_premium) + \
+        self.data.loc[indexes, 'educ'] * self.educ * flag * self.data.loc[indexes, "TOTAL"])
+        return self
+
+    def _stock_only_premium(self):
         if 0 < self.stock_together_ratio < 0.1:
             market_premium = self.inflat + 0.03
         elif 0.1 <= self.stock_together_ratio < 0.2:
@@ -138,14 +286,19 @@ class InvestingOptions:
             market_premium = self.inflat + 0.09
         else:
             market_premium = self.inflat - 0.03
-        self.data.loc[indexes, mon_fut] = 0.33 * (self.data.loc[indexes, "TOTAL"] * (1 + market_premium) + \
-        self.data.loc[indexes, 'educ'] * self.educ * flag * self.data.loc[indexes, "TOTAL"])
-        return self
+        return market_premium
 
     def stock_together(self, indexes, mon_fut, flag = 0):
         '''
         АКЦИЯ РОСТА
         '''
+        market_premium = self._stock_together_premium()
+        self.data.loc[indexes, mon_fut] = (1 / 3) * \
+        (self.data.loc[indexes, "TOTAL"] * (1 + market_premium) + \
+         self.data.loc[indexes, "TOTAL"] * flag * self.educ * self.data.loc[indexes, 'educ'])
+        return self
+
+    def _stock_together_premium(self):
         if not self.was_more_than_40:
             if self.year == 7:
                 market_premium = self.inflat + 0.035
@@ -162,33 +315,37 @@ class InvestingOptions:
             self.checker = True
         else:
             pass
+        return market_premium
 
+    def stock_index(self, indexes, mon_fut, flag = 0):
+        return_rate = self._stock_index_rate()
         self.data.loc[indexes, mon_fut] = (1 / 3) * \
-        (self.data.loc[indexes, "TOTAL"] * (1 + market_premium) + \
-         self.data.loc[indexes, "TOTAL"] * flag * self.educ * self.data.loc[indexes, 'educ'])
+        (self.data.loc[indexes, "TOTAL"] * return_rate + \
+        self.data.loc[indexes, "TOTAL"] * self.educ * self.data.loc[indexes, 'educ'])
         return self
 
-    def stock_index(self, indexes, mon_fut, flag = 0):
+    def _stock_index_rate(self):
         expected_return = 1 + self.inflat - 0.01
         '''
         ЭТО КАК РАЗ БАРСУЧИЙ СЛУЧАЙ
         нормальное распределение с матожиданием 4 и дисперсией 1. При этом дивы по дефолту 3
         '''
-        noise_1 = self.make_random_noise(0.035, 0.0125)
-        noise_2 = self.make_random_noise(0.015, 0.0125)
-        add = np.random.choice(a=[noise_1, noise_2], size=1, p=[1 / 2, 1 / 2])
-        self.data.loc[indexes, mon_fut] = (1 / 3) * \
-        (self.data.loc[indexes, "TOTAL"] * (expected_return + add) + \
-        self.data.loc[indexes, "TOTAL"] * self.educ * self.data.loc[indexes, 'educ'])
-        return self
+        noise_1 = self._shock('stock_index_noise_1')
+        noise_2 = self._shock('stock_index_noise_2')
+        add = noise_2 if self._shock('stock_index_pick') else noise_1
+        return expected_return + add
 
     def sosed(self, indexes, mon_fut, flag=0):
-        outcomes = np.random.choice(a=[0.1, 0.0], size=len(indexes), p=[1 / 2, 1 / 2])
-        outcomes += 1
+        outcomes = self._sosed_rates(len(indexes))
         self.data.loc[indexes, mon_fut] = (1 / 3) * (self.data.loc[indexes, "TOTAL"] * outcomes + \
         self.data.loc[indexes, "TOTAL"] * flag *self.educ * self.data.loc[indexes, 'educ'])
         return self
 
+    def _sosed_rates(self, size):
+        outcomes = self.shocks.sosed(self.slot, size)
+        outcomes += 1
+        return outcomes
+
     def mortgage(self, indexes, mon_fut, flag = 0):
         """
         Сначала проверяем, что они использовали опцию накопа в недвиге, потом зачисляем тем, у кого уже есть актив
@@ -197,10 +354,7 @@ class InvestingOptions:
         if self.first_check_mortgage:
             self.checker_for_mortgage(indexes)
             self.first_check_mortgage = False
-        return_mortgage = 1.07  # FIX
-        return_mortgage_init = 1.03
-        return_mortgage += self.make_random_noise(0, 0.01)
-        return_mortgage_init += self.make_random_noise(0, 0.01)
+        return_mortgage, return_mortgage_init = self._mortgage_rates()
         """
         condition_first = self.data['mortgage_count'] != 0
         if self.data[condition_first].shape[0] == 0: #проверка, чтобы не было ошибки в коде - начисляем хоть кому-то
@@ -247,6 +401,13 @@ class InvestingOptions:
             self.accrue_mortgage(indexes_to_nakop, mon_fut, return_mortgage, flag='nakop', flag_ed=flag)
         return self
 
+    def _mortgage_rates(self):
+        return_mortgage = 1.07  # FIX
+        return_mortgage_init = 1.03
+        return_mortgage += self._shock('mortgage_noise')
+        return_mortgage_init += self._shock('mortgage_init_noise')
+        return return_mortgage, return_mortgage_init
+
     def accrue_mortgage(self, indexes, mon_fut, return_rate, flag, flag_ed = 0):
         to_accrue = (1 / 3) * \
                 (self.data.loc[indexes, 'TOTAL'] * return_rate + \
@@ -320,6 +481,10 @@ class InvestingOptions:
                        'stock_index': self.stock_index,
                        'mortgage': self.mortgage}
         # bool_flag = self._return_bool_flag()
+        slot = int(year_column[-1])
+        self.slot = slot
+        if self.metrics is not None:
+            slot_start = time.perf_counter()
         for option in opportunities:
             if option == 'education':
                 pass
@@ -331,16 +496,173 @@ class InvestingOptions:
                     self.education(ind_for_ed, fut_money)
                     continue
                 '''
+                if self.metrics is not None:
+                    start = time.perf_counter()
                 try:
                     option_dict[option](players_, fut_money, flag=1)
                 except Exception as e:
-                    print(e)
-                    exc_type, exc_obj, exc_tb = sys.exc_info()
-                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    print(exc_type, fname, exc_tb.tb_lineno)
+                    self._fallback_(slot, option, len(players_), e)
                     self.bank(players_, fut_money, flag=1)
+                if self.metrics is not None:
+                    self.metrics.add_option(slot, option, time.perf_counter() - start, len(players_))
+        if self.metrics is not None:
+            self.metrics.slot_seconds[slot] = time.perf_counter() - slot_start
+        return self
+
+    def _fallback_(self, slot, option, players, error):
+        '''
+        Откат опции на банк: пишем в лог и в метрики раунда
+        '''
+        logger.debug('slot %s: %r falls back to bank for %d players: %r', slot, option, players, error)
+        if self.metrics is not None and players:
+            self.metrics.add_fallback(slot, option, players, error)
+
+    def _accrue_vector_(self):
+        '''
+        Однопроходный режим начисления. Выборы по трем активам кодируются в целые числа один раз, скалярные
+        розыгрыши по опциям складываются в векторы, индексируемые кодом выбора, и доходность слота считается
+        для всех игроков сразу. Розыгрыши делаются в том же порядке, что и в _accrue_money_ (по первому
+        появлению опции в колонке), поэтому при одинаковом seed результат совпадает со старым режимом,
+        включая откат на банк при ошибке и пропуски (NaN) с нулевым активом. Счетчики ипотеки двигает
+        mortgage.MortgageLedger сразу за весь год.
+        :return: self
+        '''
+        from mortgage import MortgageLedger, NAKOP
+
+        slots = [(self.choice_1, self.future_money_1),
+                 (self.choice_2, self.future_money_2),
+                 (self.choice_3, self.future_money_3)]
+        codes = [encode_choices(self.data[choice]) for choice, _ in slots]
+        self.codes = codes
+        total = self.data['TOTAL'].to_numpy(dtype=float)
+        educ = self.data['educ'].to_numpy(dtype=float)
+        bonus = total * self.educ * educ  # допдоход от образования, flag = 1
+        bonus_only = educ * self.educ * total  # у stock_only множители в другом порядке
+        ledger = MortgageLedger.from_frame(self.data)
+        self.mortgage_active, states = ledger.settle(np.column_stack(codes) == OPTION_CODES['mortgage'])
+        self.mortgage_nakop = states == NAKOP
+        for slot, (_, fut_money) in enumerate(slots, start=1):
+            self.slot = slot
+            if self.metrics is not None:
+                start = time.perf_counter()
+            self.data[fut_money] = self._slot_payoff_(slot, codes[slot - 1], total, bonus, bonus_only)
+            if self.metrics is not None:
+                self.metrics.slot_seconds[slot] = time.perf_counter() - start
+        ledger.to_frame(self.data)
+        self.data['educ'] = self.data['educ'] + sum(slot_codes == OPTION_CODES['education'] for slot_codes in codes)
         return self
 
+    def _slot_payoff_(self, slot, codes, total, bonus, bonus_only):
+        '''
+        Доходность одного слота для всех игроков
+        :param slot: номер актива (1, 2, 3)
+        :param codes: коды выборов по слоту - np.array
+        :param total: TOTAL на начало года - np.array
+        :param bonus: допдоход от образования - np.array
+        :param bonus_only: то же самое для stock_only
+        :return: np.array с начислениями по слоту
+        '''
+        n_codes = MISSING_CODE + 1
+        coef = np.full(n_codes, 1 / 3)
+        rate = np.full(n_codes, 1 + self.inflat)  # по умолчанию банк
+        has_bonus = np.ones(n_codes)
+        coef[MISSING_CODE] = 0
+        rate[MISSING_CODE] = 0
+        has_bonus[MISSING_CODE] = 0
+        rate[OPTION_CODES['education']] = 1
+        has_bonus[OPTION_CODES['education']] = 0
+        player_rate = {}  # опции, у которых доходность разыгрывается для каждого игрока отдельно
+        use_bonus_only = False
+        if self.metrics is not None:
+            counts = np.bincount(codes, minlength=n_codes)
+        for code in pd.unique(codes):
+            if self.metrics is not None:
+                start = time.perf_counter()
+            if code == UNKNOWN_CODE:
+                self._fallback_(slot, 'unknown', int((codes == code).sum()), KeyError('unknown option'))
+                continue
+            if code in (MISSING_CODE, OPTION_CODES['education'], OPTION_CODES['bank']):
+                if self.metrics is not None and code != MISSING_CODE:
+                    self.metrics.add_option(slot, OPTIONS[code], time.perf_counter() - start, int(counts[code]))
+                continue
+            option = OPTIONS[code]
+            players_ = np.flatnonzero(codes == code)
+            try:
+                if option == 'korp_bond':
+                    rate[code] = self._korp_bond_rate()
+                elif option == 'gov_bond':
+                    rate[code] = self._gov_bond_rate()
+                elif option == 'stock_index':
+                    rate[code] = self._stock_index_rate()
+                elif option == 'stock_only':
+                    rate[code] = 1 + self._stock_only_premium()
+                    coef[code] = 0.33
+                    use_bonus_only = True
+                elif option == 'stock_together':
+                    rate[code] = 1 + self._stock_together_premium()
+                elif option == 'sosed':
+                    player_rate[code] = (players_, self._sosed_rates(len(players_)))
+                elif option == 'mortgage':
+                    player_rate[code] = (players_, self._mortgage_vector_(slot, players_))
+            except Exception as e:
+                self._fallback_(slot, option, len(players_), e)
+                rate[code] = 1 + self.inflat
+                coef[code] = 1 / 3
+            if self.metrics is not None:
+                self.metrics.add_option(slot, option, time.perf_counter() - start, len(players_))
+        player_rates = rate[codes]
+        for code, (players_, values) in player_rate.items():
+            player_rates[players_] = values
+        accrued = total * player_rates + bonus * has_bonus[codes]
+        if use_bonus_only:
+            is_only = codes == OPTION_CODES['stock_only']
+            accrued[is_only] = total[is_only] * player_rates[is_only] + bonus_only[is_only]
+        return coef[codes] * accrued
+
+    def _mortgage_vector_(self, slot, players_):
+        '''
+        Доходность ипотеки по состояниям, которые MortgageLedger.settle посчитал сразу на весь год
+        :return: доходность для каждого игрока, выбравшего ипотеку в этом слоте - np.array
+        '''
+        if not self.mortgage_active[slot - 1]:
+            raise KeyError('mortgage_count == 0 for some of the players who chose mortgage')
+        return_mortgage, return_mortgage_init = self._mortgage_rates()
+        return np.where(self.mortgage_nakop[players_, slot - 1], return_mortgage, return_mortgage_init)
+
+    def option_rates(self):
+        '''
+        Доходности всех опций по трем активам на том, что выпало в этом раунде, и при тех же долях
+        stock_together/stock_only. Розыгрыши не повторяются (см. market.RecordedShocks). Зовется после accrue
+        :return: (rates, coef) - np.array (3 × опции): доходность и доля TOTAL как в _slot_payoff_;
+                 для sosed - матожидание монетки, mortgage_rates - np.array (3 × 2): ставки NAKOP и START
+        '''
+        rates = np.full((3, len(OPTIONS)), 1 + self.inflat)
+        coef = np.full((3, len(OPTIONS)), 1 / 3)
+        mortgage_rates = np.full((3, 2), 1 + self.inflat)
+        rates[:, OPTION_CODES['education']] = 1
+        rates[:, OPTION_CODES['sosed']] = 1 + market.SOSED_WIN / 2
+        state = self.slot, self.checker, self.was_more_than_40
+        self.was_more_than_40 = self.was_more_than_40_start
+        self.shocks.replay = True
+        try:
+            for slot in (1, 2, 3):
+                self.slot = slot
+                for option, rate in (('korp_bond', self._korp_bond_rate), ('gov_bond', self._gov_bond_rate),
+                                     ('stock_index', self._stock_index_rate),
+                                     ('stock_only', lambda: 1 + self._stock_only_premium()),
+                                     ('stock_together', lambda: 1 + self._stock_together_premium())):
+                    try:
+                        rates[slot - 1, OPTION_CODES[option]] = rate()
+                    except Exception:
+                        continue  # как в движке - откат на банк
+                    if option == 'stock_only':
+                        coef[slot - 1, OPTION_CODES[option]] = 0.33
+                mortgage_rates[slot - 1] = self._mortgage_rates()
+        finally:
+            self.shocks.replay = False
+            self.slot, self.checker, self.was_more_than_40 = state
+        return rates, coef, mortgage_rates
+
     def make_random_noise(self, expected_value, std):
         '''
         штука для нормального шума с ограничениями
@@ -348,13 +670,7 @@ class InvestingOptions:
         :param std: стандартное отклонение
         :return: нормальный шум с заданными параметрами
         '''
-        noise = np.random.normal(loc=expected_value, scale=std)
-        if abs(noise) > abs(expected_value + 3 * std):
-            if noise < 0:
-                noise = expected_value - 3 * std
-            else:
-                noise = expected_value + 3 * std
-        return noise
+        return market.clipped_noise(np.random, expected_value, std)
 
     def last_education(self):
         list_of_choice = [(self.choice_1, self.future_money_1),
@@ -371,13 +687,16 @@ class InvestingOptions:
         Проход по инвестиционным опциям и начисление доходности для всех игроков
         :return: pd.DataFrame - итоговый датафрейм после 1 года игры.
         '''
-        #self.list_of_choices = [self.choice_1, self.choice_2, self.choice_3]
-        self._accrue_money_(self.choice_1, self.future_money_1)
-        #self.list_of_choices = self.list_of_choices[1:]
-        self._accrue_money_(self.choice_2, self.future_money_2)
-        #self.list_of_choices = self.list_of_choices[1:]
-        self._accrue_money_(self.choice_3, self.future_money_3)
-        self.last_education()
+        if self.engine == 'vector':
+            self._accrue_vector_()
+        else:
+            #self.list_of_choices = [self.choice_1, self.choice_2, self.choice_3]
+            self._accrue_money_(self.choice_1, self.future_money_1)
+            #self.list_of_choices = self.list_of_choices[1:]
+            self._accrue_money_(self.choice_2, self.future_money_2)
+            #self.list_of_choices = self.list_of_choices[1:]
+            self._accrue_money_(self.choice_3, self.future_money_3)
+            self.last_education()
         total_ = self.data[[self.future_money_1, self.future_money_2, self.future_money_3]].sum(axis=1)
         self.data[f'TOTAL_year_{self.year}_for_dohod'] = self.data['TOTAL']
         self.data[f"asset_{self.year}_1_for_dohod"] = self.data[self.future_money_1]
@@ -389,40 +708,195 @@ class InvestingOptions:
         return self.data
 
 
+class YearHistory:
+    '''
+    Хранилище сыгранных лет в виде массивов игрок × год × актив. Живой датафрейм Repository.data держит только
+    текущий и прошлый год, а все сыгранные годы дописываются сюда - так ширина живого датафрейма не растет
+    от раунда к раунду. Отсюда же читает страничка статистики (объекты History).
+    '''
+
+    def __init__(self, ids, capacity=8):
+        self.ids = np.asarray(ids)
+        self._position = {player_id: i for i, player_id in enumerate(self.ids)}
+        self.years = []
+        self._choices = np.full((len(self.ids), capacity, 3), MISSING_CODE, dtype=np.int8)
+        self._assets = np.zeros((len(self.ids), capacity, 3))
+        self._totals = np.zeros((len(self.ids), capacity))  # TOTAL на начало года
+        self._state = np.zeros((len(self.ids), capacity, len(HISTORY_STATE)), dtype=np.int16)  # после года
+
+    @classmethod
+    def from_arrays(cls, ids, years, choices, assets, totals, state=None):
+        '''
+        :param years: сыгранные годы
+        :param choices, assets, totals, state: массивы по этим годам, как в append
+        '''
+        history = cls(ids, capacity=1)
+        if len(years):  # массивы берутся как есть, место под следующие годы добавит _grow
+            history.years = list(years)
+            history._choices, history._assets, history._totals = choices, assets, totals
+            if state is None:
+                state = np.zeros(assets.shape[:2] + (len(HISTORY_STATE),), dtype=np.int16)
+            history._state = state
+        return history
+
+    def _grow(self):
+        capacity = self._assets.shape[1]
+        self._choices = np.concatenate([self._choices, np.full_like(self._choices, MISSING_CODE)], axis=1)
+        self._assets = np.concatenate([self._assets, np.zeros_like(self._assets)], axis=1)
+        self._totals = np.concatenate([self._totals, np.zeros_like(self._totals)], axis=1)
+        self._state = np.concatenate([self._state, np.zeros_like(self._state)], axis=1)
+        return capacity * 2
+
+    def append(self, year, choices, assets, totals, state=0):
+        '''
+        Дописать сыгранный год. Повторная запись последнего года (переигровка) его перезаписывает
+        :param year: номер года
+        :param choices: коды выборов - np.array (игроки × 3)
+        :param assets: начисления по активам - np.array (игроки × 3)
+        :param totals: TOTAL на начало года - np.array
+        :param state: HISTORY_STATE после года - np.array (игроки × len(HISTORY_STATE))
+        :return: self
+        '''
+        if self.years and self.years[-1] == year:
+            k = len(self.years) - 1
+        elif self.years and year < self.years[-1]:
+            raise ValueError(f'year {year} is already in the history')
+        else:
+            k = len(self.years)
+            if k == self._assets.shape[1]:
+                self._grow()
+            self.years.append(year)
+        self._choices[:, k, :] = choices
+        self._assets[:, k, :] = assets
+        self._totals[:, k] = totals
+        self._state[:, k, :] = state
+        return self
+
+    @property
+    def nbytes(self):
+        return self._choices.nbytes + self._assets.nbytes + self._totals.nbytes + self._state.nbytes
+
+    def _year_index(self, year):
+        try:
+            return self.years.index(year)
+        except ValueError:
+            raise KeyError(f'year {year} is not in the history')
+
+    def choices(self, year):
+        return self._choices[:, self._year_index(year), :]
+
+    def assets(self, year):
+        return self._assets[:, self._year_index(year), :]
+
+    def totals(self, year):
+        return self._totals[:, self._year_index(year)]
+
+    def state(self, year):
+        return self._state[:, self._year_index(year), :]
+
+    def player(self, player_id):
+        '''
+        История конкретного игрока для странички статистики
+        :param player_id: айдишник игрока
+        :return: list из History, доходность считается от трети TOTAL на начало года
+        '''
+        i = self._position[player_id]
+        k = len(self.years)
+        choices = self._choices[i, :k]
+        share = self._totals[i, :k] / 3
+        with np.errstate(divide='ignore', invalid='ignore'):
+            increase = self._assets[i, :k] / share[:, None] - 1
+        return [History(year, player_id,
+                        CODE_NAMES[choices[j, 0]], CODE_NAMES[choices[j, 1]],
+                        increase[j, 0], increase[j, 1],
+                        act_c=CODE_NAMES[choices[j, 2]], increase_c=increase[j, 2])
+                for j, year in enumerate(self.years)]
+
+
 class Repository:
 
-    def __init__(self, id_, more_than_40 = None, year=None, inflation_rate=0.04, educ_dohod=0.0033):
+    def __init__(self, id_, more_than_40 = None, year=None, inflation_rate=0.04, educ_dohod=0.0033,
+                 engine='vector', backend=None, autosave=False, metrics=None, seed=None,
+                 tape=None, checkpoints=None, schema=None):
         '''
         Базовое правило в названии колонок: сначала ГОД, потом номер актива
         :param id_: айдишники игроков
         :param inflation_rate: базовая цифра, от которой отталкиваются дальнейшие проценты - уровень инфляции
+        :param engine: режим начисления в InvestingOptions - 'vector' (по умолчанию) или 'loop'
+        :param backend: хранилище игроков (persistence.Backend), по умолчанию Django ORM
+        :param autosave: после каждого Gamble записывать изменившихся игроков в хранилище (см. save)
+        :param metrics: metrics.EngineMetrics для замеров по раундам, None - без замеров
+        :param seed: seed игры (неотрицательное целое) - у игры свой поток розыгрышей на каждый год и актив,
+                     раунд воспроизводится по seed и году (см. market.SeededShocks). None - глобальный np.random
+        :param tape: market.ScenarioTape - рынок берется с общей ленты турнира, seed тогда не нужен
+        :param checkpoints: checkpoints.CheckpointStore - после каждого Gamble туда пишется контрольная точка
+        :param schema: schema.StateSchema - типы колонок data и строгая проверка выборов, по умолчанию StateSchema()
         '''
-        a = Player.objects.all() or [Player(Name='TestUser')]
+        seed = _check_seed(seed)  # до обращений к хранилищу
+        self.backend = backend or get_default_backend()
+        a = self.backend.load_players()  # колонки целиком, одним запросом
         # a = Factory.get_notreal_players() # TODO тут
-        self.id_ = [i.ID for i in a]
-        aa = Admin.objects.all()
-        if len(aa) == 0:
-            year = 0
-            Admin(Day=2).save()
-        else:
-            year = list(Admin.objects.all())[-1:][0].Day - 2
-        data = pd.DataFrame({"id": self.id_})  # инициализация id
-        data["TOTAL"] = [i.SumActive() for i in a]
-        data[f"asset_{year}_1"] = [i.Active_a for i in a]  # инициализация актива 1
-        data[f"asset_{year}_2"] = [i.Active_b for i in a]  # инициализация актива 2
-        data[f"asset_{year}_3"] = [i.Active_c for i in a]
-        data['mortgage_count'] = [i.Mortgage_count for i in a]
-        data['further_mortgage'] = [i.Further_mortgage for i in a]
-        data['now_mortgage'] = [i.Now_mortgage for i in a]
-        data['educ'] = [i.Education for i in a]
+        self.id_ = list(a['ID'])
+        year = self.backend.current_year()
+        data = pd.DataFrame({"id": self.id_,  # инициализация id
+                             "TOTAL": a['TOTAL'],
+                             f"asset_{year}_1": a['Active_a'],  # инициализация актива 1
+                             f"asset_{year}_2": a['Active_b'],  # инициализация актива 2
+                             f"asset_{year}_3": a['Active_c'],
+                             'mortgage_count': a['Mortgage_count'],
+                             'further_mortgage': a['Further_mortgage'],
+                             'now_mortgage': a['Now_mortgage'],
+                             'educ': a['Education']})
         data = data.set_index("id")  # смена индекса на id
-        self.data = data
+        more_than_40 = False if more_than_40 is None else more_than_40
+        self._setup_(data, year, more_than_40, YearHistory(data.index), None, inflation_rate, educ_dohod,
+                     engine, autosave, metrics, seed, tape, checkpoints, schema)
+
+    def _setup_(self, data, year, more_than_40, history, saved, inflation_rate, educ_dohod, engine, autosave,
+                metrics, seed, tape, checkpoints, schema):
+        from schema import StateSchema
+
+        self.schema = schema if schema is not None else StateSchema()
+        self.data = self.schema.apply(data)
+        self.year = year
+        self.autosave = autosave
+        self.metrics = metrics
+        self._saved = self._player_columns() if saved is None else saved  # то, что сейчас лежит в хранилище
+        self.leaderboard = Leaderboard()
+        self.leaderboard.rebuild(self.data.index, self.data['TOTAL'].to_numpy(), year=year)
+        self.history = history
         self.inflation = inflation_rate
         self.educ_dohod = educ_dohod
-        if more_than_40 is None:
-            self.more_than_40 = False
-        else:
-            self.more_than_40 = more_than_40
+        self.engine = engine
+        self.seed = seed
+        self.tape = tape
+        self.checkpoints = checkpoints
+        self.more_than_40 = more_than_40
+        from aggregates import GameAggregates
+        from counterfactual import Counterfactuals
+
+        self.generation = next(_generations)  # меняется на каждом Gamble и при подъеме из контрольной точки
+        self.counterfactuals = Counterfactuals(educ_dohod)
+        self.aggregates = GameAggregates()
+        self._record_state_()
+
+    @classmethod
+    def from_state(cls, data, year, more_than_40, history, saved, inflation_rate=0.04, educ_dohod=0.0033,
+                   engine='vector', backend=None, autosave=False, metrics=None, seed=None, tape=None,
+                   checkpoints=None, schema=None):
+        '''
+        Игра из готового состояния (см. checkpoints.CheckpointStore.load), без загрузки игроков из хранилища
+        :param data: живой датафрейм с индексом id
+        :param history: YearHistory
+        :param saved: то, что лежит в хранилище - dict колонок, как из _player_columns
+        '''
+        seed = _check_seed(seed)
+        repo = cls.__new__(cls)
+        repo.backend = backend or get_default_backend()
+        repo.id_ = list(data.index)
+        repo._setup_(data, year, more_than_40, history, saved, inflation_rate, educ_dohod, engine, autosave,
+                     metrics, seed, tape, checkpoints, schema)
+        return repo
 
     def Choice(self,
                year,  # номер года
@@ -434,15 +908,20 @@ class Repository:
         year_2 = "year_" + str(year) + '_2'  # название колонки с выборами касательно актива 2
         year_3 = "year_" + str(year) + '_3'  # SAME but active 3
 
-        self.data[year_1] = asset_1_choice
-        self.data[year_2] = asset_2_choice
-        self.data[year_3] = asset_3_choice
+        # сначала проверяются все три актива: в строгом режиме неизвестная опция не оставит полраунда в data
+        choices = [self.schema.choices(choice) for choice in (asset_1_choice, asset_2_choice, asset_3_choice)]
+        self.data[year_1], self.data[year_2], self.data[year_3] = choices
+        if all(f'asset_{year - 1}_{slot}' in self.data for slot in (1, 2, 3)):
+            self._record_choices_(year)
 
         '''ЭТУ ФУНКЦИЮ МОЖНО БУДЕТ ИЗМЕНЯТЬ В ЗАВИСИМОСТИ ОТ ХАРАКТЕРА ПРИНИМАЕМЫХ ДАННЫХ ПО ВЫБОРУ АКТИВА'''
         ''' я не понял зачем нам тут это, но ладно, оставлю (комментарий от меня)'''
         return self.data
 
     def Gamble(self, year):  # номер года
+        from counterfactual import RoundInputs
+
+        shocks = self.shocks(year)  # до любых изменений data: короткая лента не оставит полгода в колонках
 
         asset_1_is = "asset_" + str(year) + '_1'  # получаем тикер актива 1, который подается на выход
         asset_2_is = "asset_" + str(year) + '_2'  # получаем тикер актива 2, который подается на выход
@@ -460,28 +939,150 @@ class Repository:
         asset_2_was = "asset_" + str(year - 1) + '_2'
         asset_3_was = 'asset_' + str(year - 1) + '_3'
 
-        N_together = self.data[self.data[choice_1] == "stock_together"][asset_1_was].sum()  # исправить на 1 строку
-        N_together += self.data[self.data[choice_2] == "stock_together"][asset_2_was].sum()
-        N_together += self.data[self.data[choice_3] == "stock_together"][asset_3_was].sum()
-        N_together = N_together / self.data["TOTAL"].sum()
-
-        N_only = self.data[self.data[choice_1] == "stock_only"][choice_1].count()  # исправить на 1 строку
-        N_only += self.data[self.data[choice_2] == "stock_only"][choice_2].count()
-        N_only += self.data[self.data[choice_3] == "stock_only"][choice_3].count()
+        if year not in self.aggregates.rounds:  # выборы записаны в data в обход Choice
+            self._record_choices_(year)
+        N_together, N_only = self.aggregates.crowd_ratios(year, self.data["TOTAL"].sum())
 
+        round_metrics = None
+        if self.metrics is not None:
+            start = time.perf_counter()
+            round_metrics = self.metrics.round(year, N_together, N_only)
         gambling = InvestingOptions(self.data, year, educ_dohod=self.educ_dohod,
                                     inflation_rate=self.inflation,
-                                    number_only=N_only / len(self.data),  # корректировка
+                                    number_only=N_only,
                                     number_together=N_together,
-                                    was_more_than_40=self.more_than_40)
+                                    was_more_than_40=self.more_than_40,
+                                    engine=self.engine,
+                                    metrics=round_metrics,
+                                    shocks=shocks)
+        educ = self.data['educ'].to_numpy(copy=True)
+        mortgage_count = self.data['mortgage_count'].to_numpy(copy=True)
+        mortgage_gap = (self.data['now_mortgage'] - self.data['further_mortgage']).to_numpy()
         new_data = gambling.accrue()
+        self.counterfactuals.record(year, RoundInputs(*gambling.option_rates(), educ, mortgage_count,
+                                                      mortgage_gap))
         new_data['now_mortgage'] = new_data['further_mortgage']
         new_data['further_mortgage'] = 0
-        self.data = new_data
-        print(new_data[['mortgage_count', 'further_mortgage', 'now_mortgage']])
+        self.data = self.schema.apply(new_data)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('mortgage counters after year %s:\n%s', year,
+                         new_data[['mortgage_count', 'further_mortgage', 'now_mortgage']])
         self.more_than_40 = gambling.was_more_than_40
+        codes = gambling.codes or [encode_choices(self.data[choice]) for choice in (choice_1, choice_2, choice_3)]
+        self.history.append(year, np.column_stack(codes),
+                            self.data[[asset_1_is, asset_2_is, asset_3_is]].to_numpy(dtype=float),
+                            self.data[f'TOTAL_year_{year}_for_dohod'].to_numpy(dtype=float),
+                            self.data[list(HISTORY_STATE)].to_numpy())
+        self._drop_old_years_(year)
+        self.year = year
+        self.leaderboard.rebuild(self.data.index, self.data['TOTAL'].to_numpy(), year=year)
+        self._record_state_()
+        self.generation = next(_generations)
+        if round_metrics is not None:
+            round_metrics.seconds = time.perf_counter() - start
+            self.metrics.record(round_metrics)
+        if self.autosave:
+            self.save()
+        if self.checkpoints is not None:
+            try:
+                self.checkpoints.save(self)
+            except Exception:  # раунд уже сыгран и опубликован - ошибка точки не должна выглядеть как ошибка раунда
+                logger.exception('checkpoint of year %s failed', year)
         return self.data, self.more_than_40
 
+    def shocks(self, year):
+        '''
+        Розыгрыши рынка за год: те же, что выпали (или выпадут) в Gamble этого года
+        :return: market.TapeShocks или market.SeededShocks, None если у игры нет ни ленты, ни seed
+        '''
+        if self.tape is not None:
+            return self.tape.shocks(year)
+        if self.seed is None:
+            return None
+        return market.SeededShocks(self.seed, year)
+
+    def _record_choices_(self, year):
+        '''
+        Один проход по выборам года: счетчики опций и вложенные суммы для aggregates (и N_together/N_only)
+        '''
+        return self.aggregates.record_choices(
+            year, [encode_choices(self.data[f'year_{year}_{slot}']) for slot in (1, 2, 3)],
+            [self.data[f'asset_{year - 1}_{slot}'].to_numpy() for slot in (1, 2, 3)])
+
+    def _record_state_(self):
+        self.aggregates.record_state(self.year, self.data['TOTAL'].to_numpy(), self.data['educ'].to_numpy(),
+                                     self.data['mortgage_count'].to_numpy())
+        return self
+
+    def memory_usage(self):
+        '''
+        :return: сколько байт занимает состояние игры (живой датафрейм и история)
+        '''
+        return int(self.data.memory_usage(deep=True).sum()) + self.history.nbytes + self.counterfactuals.nbytes
+
+    def _player_columns(self):
+        '''
+        Состояние игроков в терминах полей модели Player
+        :return: dict колонок - np.array
+        '''
+        return {'Active_a': self.data[f'asset_{self.year}_1'].to_numpy(copy=True),
+                'Active_b': self.data[f'asset_{self.year}_2'].to_numpy(copy=True),
+                'Active_c': self.data[f'asset_{self.year}_3'].to_numpy(copy=True),
+                'Mortgage_count': self.data['mortgage_count'].to_numpy(copy=True),
+                'Further_mortgage': self.data['further_mortgage'].to_numpy(copy=True),
+                'Now_mortgage': self.data['now_mortgage'].to_numpy(copy=True),
+                'Education': self.data['educ'].to_numpy(copy=True)}
+
+    def save(self, batch_size=500):
+        '''
+        Записывает в хранилище активы, образование и счетчики ипотеки всех игроков, у которых они поменялись
+        с прошлой загрузки или записи. Одна транзакция, bulk-запросы пачками по batch_size
+        :return: число записанных игроков
+        '''
+        columns = self._player_columns()
+        changed = np.zeros(len(self.data), dtype=bool)
+        for field, values in columns.items():
+            changed |= values != self._saved[field]
+        changed &= self.data.index.notna()  # тестовый игрок без ID в базе не лежит
+        rows = np.flatnonzero(changed)
+        if len(rows):
+            to_save = {'ID': self.data.index[rows].tolist()}
+            to_save.update({field: values[rows].tolist() for field, values in columns.items()})
+            self.backend.save_players(to_save, batch_size=batch_size)
+        self._saved = columns
+        return len(rows)
+
+    def _drop_old_years_(self, year):
+        '''
+        Убирает из живого датафрейма колонки всех лет старше прошлого - они уже лежат в self.history
+        :param year: номер текущего года
+        :return: self
+        '''
+        old_columns = [column for column in self.data.columns
+                       if YEAR_COLUMN.match(column) and int(YEAR_COLUMN.match(column).group(1)) < year - 1]
+        if old_columns:
+            self.data = self.data.drop(columns=old_columns)
+        return self
+
+    def get_history(self, player_id):
+        '''
+        :param player_id: айдишник игрока
+        :return: list из History по всем сыгранным годам
+        '''
+        return self.history.player(player_id)
+
+    def counterfactual(self, year, player_id=None):
+        '''
+        Сколько принесла бы каждая опция за сыгранный год (см. counterfactual.py). Матрица считается один раз
+        и кешируется для последних запрошенных лет
+        :param player_id: None - вся игра, иначе один игрок
+        :return: np.array (игроки × 3 × опции) или (3 × опции) для одного игрока, опции в порядке OPTIONS
+        '''
+        matrix = self.counterfactuals.matrix(year, self.history)
+        if player_id is None:
+            return matrix
+        return matrix[self.history._position[player_id]]
+
 # a = Factory()
 # Player(Name='Vasya3').save()
 # Player(Name='Vasya2').save()
@@ -0,0 +1,74 @@
+'''
+Типы колонок живого датафрейма Repository.data:
+    year_{год}_{актив}          - выборы, pd.Categorical с фиксированной таблицей CHOICE_DTYPE (1 байт на игрока);
+                                  код категории совпадает с кодом OPTION_CODES, неизвестная опция - 'unknown'
+                                  (UNKNOWN_CODE, начисляется как банк), пропуск - NaN;
+    mortgage_count, further_mortgage, now_mortgage, educ - COUNTER_DTYPE;
+    TOTAL, asset_*, TOTAL_year_* - float_dtype (по умолчанию float64: результат тот же, что и раньше).
+Считается все по-прежнему в float64, в float_dtype округляется только то, что хранится между раундами.
+Сравнения с опцией в движке идут по коду категории, а не по строкам.
+'''
+import numpy as np
+import pandas as pd
+
+from repository import OPTIONS, UNKNOWN_CODE, YEAR_COLUMN
+
+CHOICE_DTYPE = pd.CategoricalDtype(OPTIONS + ('unknown',))
+COUNTER_COLUMNS = ('mortgage_count', 'further_mortgage', 'now_mortgage', 'educ')
+COUNTER_DTYPE = np.dtype(np.int16)  # как состояние в YearHistory
+
+
+class StateSchema:
+    '''
+    :param float_dtype: тип сумм - 'float64' или 'float32'
+    :param strict: неизвестная опция в Choice - ValueError, а не молчаливый откат на банк
+    '''
+
+    def __init__(self, float_dtype='float64', strict=False):
+        self.float_dtype = np.dtype(float_dtype)
+        if self.float_dtype.kind != 'f':
+            raise ValueError(f'float_dtype must be a float type, got {self.float_dtype}')
+        self.strict = strict
+
+    def choices(self, column):
+        '''
+        Колонка выборов в CHOICE_DTYPE. pd.Series остается pd.Series с тем же индексом
+        :param column: выборы игроков за год по одному активу - pd.Series / np.array / list
+        '''
+        if getattr(column, 'dtype', None) == CHOICE_DTYPE and not self.strict:
+            return column
+        values = pd.Series(column, dtype=object).to_numpy()
+        codes = pd.Categorical(values, categories=OPTIONS).codes.astype(np.int8)
+        unknown = (codes == -1) & pd.notna(values)
+        if unknown.any():
+            if self.strict:
+                raise ValueError(f'unknown options {sorted(set(map(str, values[unknown])))}')
+            codes[unknown] = UNKNOWN_CODE
+        categorical = pd.Categorical.from_codes(codes, dtype=CHOICE_DTYPE)
+        if isinstance(column, pd.Series):
+            return pd.Series(categorical, index=column.index, name=column.name)
+        return categorical
+
+    def dtype(self, column):
+        '''
+        :return: тип колонки по схеме, None - колонка схеме не подчиняется
+        '''
+        if column in COUNTER_COLUMNS:
+            return COUNTER_DTYPE
+        if column == 'TOTAL':
+            return self.float_dtype
+        if isinstance(column, str) and YEAR_COLUMN.match(column):
+            return CHOICE_DTYPE if column.startswith('year_') else self.float_dtype
+        return None
+
+    def apply(self, data):
+        '''
+        Приводит колонки датафрейма к схеме на месте. Колонки, у которых тип уже правильный, не трогаются
+        :return: data
+        '''
+        for column, dtype in data.dtypes.items():
+            target = self.dtype(column)
+            if target is None or dtype == target:
+                continue
+            data[column] = self.choices(data[column]) if target == CHOICE_DTYPE else data[column].astype(target)
+        return data
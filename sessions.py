@@ -0,0 +1,244 @@
+'''
+Несколько игр в одном процессе. SessionManager держит живые Repository по айди игры и вытесняет давно
+не использованные (LRU) при превышении лимита по числу игр или по памяти. Вытесненная игра записывается в
+хранилище игроков и выгружается на диск целиком, при следующем обращении она поднимается обратно.
+
+Каждая игра под своим замком: Choice/Gamble разных игр друг друга не ждут.
+
+У каждой игры должно быть свое хранилище игроков: в модели Player нет поля игры, и две игры на одном
+хранилище читали бы один и тот же список игроков и затирали бы друг другу записи. Поэтому SessionManager
+не дает второй игре хранилище, которое уже занято другой (ValueError), а Factory берет хранилище игры
+из backend_for.
+'''
+import functools
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class SessionManager:
+    '''
+    :param create: функция game_id -> Repository для новой игры, по умолчанию Repository(game_id)
+    :param max_games: сколько игр держать в памяти одновременно, None - без ограничения
+    :param max_bytes: ограничение по памяти на все живые игры (Repository.memory_usage), None - без ограничения
+    :param spill_dir: папка для выгруженных игр, по умолчанию временная
+    '''
+
+    def __init__(self, create=None, max_games=None, max_bytes=None, spill_dir=None):
+        self.create = create or _create_repository
+        self.max_games = max_games
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='freezy_games_')
+        self._games = OrderedDict()  # game_id -> Repository, от давно использованных к недавним
+        self._sizes = {}
+        self._backends = {}  # бэкенды выгруженных игр - в pickle не попадают
+        self._metrics = {}  # то же для metrics: EngineMetrics бывает общим на несколько игр
+        self._owners = {}  # id(бэкенда) -> (бэкенд, айди игры, которой он принадлежит)
+        self._locks = {}
+        self._in_use = {}  # сколько блоков session сейчас открыто по игре - такие игры не вытесняются
+        self._lock = threading.Lock()  # только для словарей выше, вычисления под ним не идут
+
+    def _game_lock(self, game_id):
+        with self._lock:
+            return self._locks.setdefault(game_id, threading.RLock())
+
+    def _spill_path(self, game_id):
+        return os.path.join(self.spill_dir, f'{game_id}.pkl')
+
+    @contextmanager
+    def session(self, game_id, **kwargs):
+        '''
+        Эксклюзивный доступ к игре на время блока with
+        :param kwargs: аргументы для create, если игры еще нет
+        '''
+        lock = self._game_lock(game_id)
+        with lock:
+            repo = self._load(game_id, **kwargs)
+            with self._lock:
+                self._in_use[game_id] = self._in_use.get(game_id, 0) + 1
+            try:
+                yield repo
+            finally:
+                with self._lock:
+                    self._in_use[game_id] -= 1
+                    self._sizes[game_id] = repo.memory_usage()
+        self._shrink()
+
+    def get(self, game_id, **kwargs):
+        '''
+        :return: GameHandle - сам Repository наружу не отдается: его могли бы вытеснить, пока на него есть ссылка
+        '''
+        with self.session(game_id, **kwargs):
+            return GameHandle(self, game_id)
+
+    def generation(self, game_id):
+        '''
+        Repository.generation игры без замка игры и без пересчета памяти; невыгруженная игра поднимается
+        '''
+        with self._lock:
+            repo = self._games.get(game_id)
+            if repo is not None:
+                return repo.generation
+        with self.session(game_id) as repo:
+            return repo.generation
+
+    def choice(self, game_id, year, asset_1_choice, asset_2_choice, asset_3_choice):
+        with self.session(game_id) as repo:
+            return repo.Choice(year, asset_1_choice, asset_2_choice, asset_3_choice)
+
+    def gamble(self, game_id, year):
+        with self.session(game_id) as repo:
+            return repo.Gamble(year)
+
+    def collect(self, game_id, year, **kwargs):
+        '''
+        Прием выборов по одному игроку с автоматическим закрытием раунда (см. ingestion.RoundCollector).
+        Choice и Gamble при закрытии идут под замком игры
+        '''
+        from ingestion import RoundCollector
+
+        def play(year, asset_1_choice, asset_2_choice, asset_3_choice):
+            with self.session(game_id) as repo:
+                repo.Choice(year, asset_1_choice, asset_2_choice, asset_3_choice)
+                return repo.Gamble(year)
+
+        return RoundCollector(self.get(game_id), year, play=play, **kwargs)
+
+    def _load(self, game_id, **kwargs):
+        with self._lock:
+            repo = self._games.get(game_id)
+            if repo is not None:
+                self._games.move_to_end(game_id)
+                return repo
+        path = self._spill_path(game_id)
+        spilled = os.path.exists(path)
+        if spilled:
+            with open(path, 'rb') as file:
+                repo = pickle.load(file)
+            if game_id in self._backends:
+                repo.backend, repo.metrics = self._backends[game_id], self._metrics[game_id]
+            else:  # файл выгрузил другой процесс или другой SessionManager - хранилище берем у новой игры
+                fresh = self.create(game_id, **kwargs)
+                repo.backend, repo.metrics = fresh.backend, fresh.metrics
+        else:
+            repo = self.create(game_id, **kwargs)
+        with self._lock:
+            _, owner = self._owners.setdefault(id(repo.backend), (repo.backend, game_id))
+            if owner != game_id:
+                raise ValueError(f'game {game_id!r} got the player backend of game {owner!r}; '
+                                 'every game needs its own backend')
+            self._games[game_id] = repo
+            self._sizes[game_id] = repo.memory_usage()
+            self._backends.pop(game_id, None)
+            self._metrics.pop(game_id, None)
+        if spilled:  # только когда игра уже поднята: при ошибке выше файл остается
+            os.remove(path)
+        return repo
+
+    def _over_limit(self):
+        return ((self.max_games is not None and len(self._games) > self.max_games) or
+                (self.max_bytes is not None and sum(self._sizes.values()) > self.max_bytes))
+
+    def _shrink(self):
+        '''
+        Вытесняет самые давние игры, пока не уложимся в лимиты. Игры, которые сейчас кем-то заняты, пропускаются
+        '''
+        with self._lock:
+            candidates = list(self._games)
+        for game_id in candidates:
+            with self._lock:
+                if not self._over_limit():
+                    return
+                if self._in_use.get(game_id):
+                    continue
+            lock = self._game_lock(game_id)
+            if lock.acquire(blocking=False):
+                try:
+                    self.evict(game_id)
+                finally:
+                    lock.release()
+
+    def evict(self, game_id):
+        '''
+        Записывает игроков в хранилище и выгружает игру на диск
+        :return: True, если игра была в памяти
+        '''
+        with self._game_lock(game_id):
+            with self._lock:
+                repo = self._games.get(game_id)
+            if repo is None:
+                return False
+            repo.save()
+            self._backends[game_id] = repo.backend
+            self._metrics[game_id] = repo.metrics
+            repo.backend = repo.metrics = None
+            try:
+                path = self._spill_path(game_id)
+                with open(path + '.tmp', 'wb') as file:
+                    pickle.dump(repo, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(path + '.tmp', path)
+            finally:
+                repo.backend = self._backends[game_id]
+                repo.metrics = self._metrics[game_id]
+            with self._lock:
+                del self._games[game_id]
+                del self._sizes[game_id]
+            return True
+
+    def close(self):
+        '''
+        Записывает в хранилище всех живых игроков всех игр
+        '''
+        with self._lock:
+            games = list(self._games.items())
+        for game_id, repo in games:
+            with self._game_lock(game_id):
+                repo.save()
+
+    def __contains__(self, game_id):
+        with self._lock:
+            return game_id in self._games or os.path.exists(self._spill_path(game_id))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._games)
+
+
+class GameHandle:
+    '''
+    Ссылка на игру по айди. Каждое обращение (атрибут, вызов метода, присваивание) берет игру заново через
+    SessionManager.session, поэтому ссылку можно держать сколько угодно: вытесненная игра поднимется обратно,
+    а Choice/Gamble пройдут под замком игры. Атрибуты (data, history, ...) - то, что лежит в игре на момент
+    обращения, менять их в обход методов нельзя
+    '''
+
+    def __init__(self, sessions, game_id):
+        object.__setattr__(self, '_sessions', sessions)
+        object.__setattr__(self, 'game_id', game_id)
+
+    def __getattr__(self, name):
+        with self._sessions.session(self.game_id) as repo:
+            value = getattr(repo, name)
+        if getattr(value, '__self__', None) is repo:  # метод игры - вызов тоже под замком
+            return functools.partial(self._call, name)
+        return value
+
+    def _call(self, name, *args, **kwargs):
+        with self._sessions.session(self.game_id) as repo:
+            return getattr(repo, name)(*args, **kwargs)
+
+    def __setattr__(self, name, value):
+        with self._sessions.session(self.game_id) as repo:
+            setattr(repo, name, value)
+
+    def __repr__(self):
+        return f'GameHandle({self.game_id!r})'
+
+
+def _create_repository(game_id, **kwargs):
+    from repository import Repository
+
+    return Repository(game_id, **kwargs)
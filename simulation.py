@@ -0,0 +1,340 @@
+'''
+Пакетный Монте-Карло симулятор для подбора параметров доходностей.
+
+Правила повторяют InvestingOptions (векторный режим), но вся математика посчитана сразу по измерению игр:
+состояние хранится в массивах игры × игроки × активы, скалярные розыгрыши делаются вектором по играм.
+Партии игр раздаются по пулу процессов. Django не нужен.
+
+Пример:
+    result = simulate(100000, 30, 10, {'random': RandomStrategy(), 'herd': HerdStrategy()})
+    result.summary()
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from market import clipped_noise
+from repository import OPTIONS
+
+BANK, SOSED, KORP_BOND, GOV_BOND, STOCK_TOGETHER, STOCK_ONLY, STOCK_INDEX, MORTGAGE, EDUCATION = range(len(OPTIONS))
+
+
+class Rules:
+    '''
+    Параметры доходностей. Значения по умолчанию совпадают с зашитыми в InvestingOptions
+    '''
+
+    def __init__(self, inflation=0.04, educ_dohod=0.0033,
+                 korp_coupons=(0.017, 0, 0.005), korp_std=0.005,
+                 gov_premium=0.005, gov_std=0.005,
+                 stock_only_tiers=((0.1, 0.03), (0.2, 0.05), (0.4, 0.07), (0.6, 0.09)),
+                 stock_only_default=-0.03, stock_only_share=0.33,
+                 together_schedule=None, together_after_crash=-0.01,
+                 crash_threshold=0.3, crash_premium=-0.29,
+                 index_discount=0.01, index_means=(0.035, 0.015), index_std=0.0125,
+                 sosed_win=0.1,
+                 mortgage_return=1.07, mortgage_init=1.03, mortgage_std=0.01):
+        self.inflation = inflation
+        self.educ_dohod = educ_dohod
+        self.korp_coupons = korp_coupons
+        self.korp_std = korp_std
+        self.gov_premium = gov_premium
+        self.gov_std = gov_std
+        self.stock_only_tiers = stock_only_tiers  # (верхняя граница доли stock_together, премия) при доле > 0
+        self.stock_only_default = stock_only_default
+        self.stock_only_share = stock_only_share
+        # премия акции роста по годам; в годы вне расписания (и без обвала) начисляется как банк
+        self.together_schedule = together_schedule or {7: 0.035, 8: 0.06, 9: 0.11, 10: 0.15}
+        self.together_after_crash = together_after_crash
+        self.crash_threshold = crash_threshold
+        self.crash_premium = crash_premium
+        self.index_discount = index_discount
+        self.index_means = index_means
+        self.index_std = index_std
+        self.sosed_win = sosed_win
+        self.mortgage_return = mortgage_return
+        self.mortgage_init = mortgage_init
+        self.mortgage_std = mortgage_std
+
+
+class MarketView:
+    '''
+    То, что видят синтетические игроки перед выбором: итоги прошлого года по каждой игре
+    :param option_returns: средняя реализованная доходность опций, NaN если опцию никто не брал - (игры × опции)
+    :param option_popularity: доля выборов каждой опции - (игры × опции)
+    '''
+
+    def __init__(self, year, n_games, option_returns, option_popularity):
+        self.year = year
+        self.n_games = n_games
+        self.option_returns = option_returns
+        self.option_popularity = option_popularity
+
+
+class Strategy:
+    '''
+    Базовая стратегия синтетического игрока. choose возвращает коды опций - np.array (игры × игроки × 3)
+    '''
+    options = tuple(range(len(OPTIONS)))
+
+    def choose(self, rng, view, n_players):
+        raise NotImplementedError
+
+    def _random(self, rng, view, n_players):
+        return np.asarray(self.options, dtype=np.int8)[rng.integers(0, len(self.options),
+                                                                    size=(view.n_games, n_players, 3))]
+
+
+class RandomStrategy(Strategy):
+    def __init__(self, options=None):
+        if options is not None:
+            self.options = tuple(OPTIONS.index(option) for option in options)
+
+    def choose(self, rng, view, n_players):
+        return self._random(rng, view, n_players)
+
+
+class GreedyStrategy(Strategy):
+    '''
+    Берет опцию с лучшей доходностью в прошлом году в своей игре, с вероятностью epsilon - случайную
+    '''
+
+    def __init__(self, epsilon=0.1):
+        self.epsilon = epsilon
+
+    def choose(self, rng, view, n_players):
+        choices = self._random(rng, view, n_players)
+        returns = view.option_returns
+        if returns is None:
+            return choices
+        returns = np.where(np.isnan(returns), -np.inf, returns)
+        best = returns.argmax(axis=1).astype(np.int8)
+        known = np.isfinite(returns).any(axis=1)
+        exploit = (rng.random(choices.shape) >= self.epsilon) & known[:, None, None]
+        return np.where(exploit, best[:, None, None], choices)
+
+
+class HerdStrategy(Strategy):
+    '''
+    Повторяет самую популярную опцию прошлого года в своей игре, с вероятностью epsilon - случайную
+    '''
+
+    def __init__(self, epsilon=0.1):
+        self.epsilon = epsilon
+
+    def choose(self, rng, view, n_players):
+        choices = self._random(rng, view, n_players)
+        if view.option_popularity is None:
+            return choices
+        best = view.option_popularity.argmax(axis=1).astype(np.int8)
+        follow = rng.random(choices.shape) >= self.epsilon
+        return np.where(follow, best[:, None, None], choices)
+
+
+class SimulationResult:
+    '''
+    :param wealth: итоговый TOTAL каждого синтетического игрока по стратегиям - dict name -> np.array
+    :param popularity: число выборов по годам, активам и опциям - np.array (годы × 3 × опции)
+    '''
+
+    def __init__(self, wealth, popularity, n_games):
+        self.wealth = wealth
+        self.popularity = popularity
+        self.n_games = n_games
+
+    def merge(self, other):
+        wealth = {name: np.concatenate([values, other.wealth[name]]) for name, values in self.wealth.items()}
+        return SimulationResult(wealth, self.popularity + other.popularity, self.n_games + other.n_games)
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        '''
+        :return: dict со статистиками богатства по стратегиям и долями выборов опций по годам
+        '''
+        wealth = {name: {'mean': float(values.mean()), 'std': float(values.std()),
+                         'quantiles': dict(zip(quantiles, np.quantile(values, quantiles).tolist()))}
+                  for name, values in self.wealth.items()}
+        counts = self.popularity.sum(axis=1)
+        shares = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+        popularity = [dict(zip(OPTIONS, year_shares.tolist())) for year_shares in shares]
+        return {'n_games': self.n_games, 'wealth': wealth, 'popularity': popularity}
+
+
+def play_batch(n_games, n_players, n_years, strategies, rules=None, seed=None, initial_asset=100.0):
+    '''
+    Прогон партии игр в одном процессе, все игры партии считаются одновременно
+    :param strategies: dict name -> (Strategy, доля игроков) или name -> Strategy (поровну)
+    :param seed: seed или np.random.SeedSequence
+    :return: SimulationResult
+    '''
+    rules = rules or Rules()
+    rng = np.random.default_rng(seed)
+    groups = _split_players(n_players, strategies)
+    n_players = sum(size for _, _, size in groups)
+    k = len(OPTIONS)
+    g_index = np.arange(n_games)[:, None]
+
+    assets = np.full((n_games, n_players, 3), initial_asset)
+    total = assets.sum(axis=2)
+    educ = np.zeros((n_games, n_players))
+    mortgage_count = np.zeros((n_games, n_players), dtype=np.int64)
+    further_mortgage = np.zeros_like(mortgage_count)
+    now_mortgage = np.zeros_like(mortgage_count)
+    more_than_40 = np.zeros(n_games, dtype=bool)
+    popularity = np.zeros((n_years, 3, k), dtype=np.int64)
+    view = MarketView(0, n_games, None, None)
+
+    for year in range(1, n_years + 1):
+        view.year = year
+        choices = np.concatenate([strategy.choose(rng, view, size) for _, strategy, size in groups], axis=1)
+        popularity[year - 1] = np.stack([np.bincount(choices[:, :, s].ravel(), minlength=k) for s in range(3)])
+
+        is_together = choices == STOCK_TOGETHER
+        with np.errstate(divide='ignore', invalid='ignore'):
+            together_ratio = (assets * is_together).sum(axis=(1, 2)) / total.sum(axis=1)
+
+        only_premium = np.full(n_games, rules.stock_only_default)
+        lower = 0
+        for upper, premium in rules.stock_only_tiers:
+            only_premium[(together_ratio > 0) & (lower <= together_ratio) & (together_ratio < upper)] = premium
+            lower = upper
+        together_premium = np.where(more_than_40, rules.together_after_crash,
+                                    rules.together_schedule.get(year, np.nan))
+        crashed = together_ratio > rules.crash_threshold
+        together_premium = np.where(crashed, rules.crash_premium, together_premium)
+
+        bonus = total * rules.educ_dohod * educ
+        pending_check = np.ones(n_games, dtype=bool)
+        new_assets = np.empty_like(assets)
+        for s in range(3):
+            codes = choices[:, :, s]
+            rate = np.empty((n_games, k))
+            rate[:, BANK] = 1 + rules.inflation
+            rate[:, KORP_BOND] = (1 + rng.choice(rules.korp_coupons, size=n_games) + rules.inflation
+                                  + clipped_noise(rng, 0, rules.korp_std, n_games))
+            rate[:, GOV_BOND] = 1 + rules.inflation + rules.gov_premium + clipped_noise(rng, 0, rules.gov_std,
+                                                                                       n_games)
+            rate[:, STOCK_ONLY] = 1 + rules.inflation + only_premium
+            rate[:, STOCK_TOGETHER] = np.where(np.isnan(together_premium), 1 + rules.inflation,
+                                               1 + rules.inflation + together_premium)
+            mixture = np.where(rng.random(n_games) < 0.5,
+                               clipped_noise(rng, rules.index_means[0], rules.index_std, n_games),
+                               clipped_noise(rng, rules.index_means[1], rules.index_std, n_games))
+            rate[:, STOCK_INDEX] = 1 + rules.inflation - rules.index_discount + mixture
+            rate[:, EDUCATION] = 1
+            rate[:, SOSED] = rate[:, MORTGAGE] = 1 + rules.inflation  # переопределяются по игрокам ниже
+
+            player_rate = rate[g_index, codes]
+            is_sosed = codes == SOSED
+            player_rate[is_sosed] = 1 + rules.sosed_win * (rng.random(is_sosed.sum()) < 0.5)
+            player_rate = np.where(codes == MORTGAGE,
+                                   _mortgage_step(rng, rules, codes, choices, pending_check, mortgage_count,
+                                                  further_mortgage, now_mortgage, 1 + rules.inflation),
+                                   player_rate)
+
+            share = np.where(codes == STOCK_ONLY, rules.stock_only_share, 1 / 3)
+            new_assets[:, :, s] = share * (total * player_rate + bonus * (codes != EDUCATION))
+
+        view = MarketView(year, n_games, _option_returns(choices, new_assets, total, k),
+                          _option_popularity(choices, k))
+        educ += (choices == EDUCATION).sum(axis=2)
+        assets = new_assets
+        total = assets.sum(axis=2)
+        more_than_40 |= crashed
+        now_mortgage = further_mortgage
+        further_mortgage = np.zeros_like(now_mortgage)
+
+    wealth = {}
+    start = 0
+    for name, _, size in groups:
+        wealth[name] = total[:, start:start + size].ravel()
+        start += size
+    return SimulationResult(wealth, popularity, n_games)
+
+
+def _split_players(n_players, strategies):
+    items = [(name, value) if isinstance(value, tuple) else (name, (value, 1.0))
+             for name, value in strategies.items()]
+    weights = np.array([share for _, (_, share) in items], dtype=float)
+    sizes = np.floor(weights / weights.sum() * n_players).astype(int)
+    sizes[:n_players - sizes.sum()] += 1
+    return [(name, strategy, size) for (name, (strategy, _)), size in zip(items, sizes)]
+
+
+def _mortgage_step(rng, rules, codes, choices, pending_check, mortgage_count, further_mortgage, now_mortgage,
+                   bank_rate):
+    '''
+    Ипотека по одному активу для всех игр сразу: проверка checker_for_mortgage (включая откат слота на банк,
+    когда у кого-то из выбравших ипотеку mortgage_count нулевой, а у других в игре - нет) и переходы счетчиков
+    '''
+    n_games = codes.shape[0]
+    is_mortgage = codes == MORTGAGE
+    has_mortgage = is_mortgage.any(axis=1)
+    nonzero = mortgage_count != 0
+    any_nonzero = nonzero.any(axis=1)
+    broken = pending_check & has_mortgage & any_nonzero & ~(nonzero | ~is_mortgage).all(axis=1)
+    check = pending_check & has_mortgage & any_nonzero & ~broken
+    count_second_choice = (choices == MORTGAGE).sum(axis=2)
+    fix = is_mortgage & check[:, None]
+    mortgage_count[fix] = np.minimum(mortgage_count, count_second_choice)[fix]
+    pending_check &= ~(has_mortgage & ~broken)
+
+    return_mortgage = rules.mortgage_return + clipped_noise(rng, 0, rules.mortgage_std, n_games)
+    return_mortgage_init = rules.mortgage_init + clipped_noise(rng, 0, rules.mortgage_std, n_games)
+    active = is_mortgage & ~broken[:, None]
+    further_mortgage[active] += 1
+    nakop = active & (now_mortgage - further_mortgage >= 0)
+    start = active & ~nakop
+    mortgage_count[start] += 1
+    mortgage_count[nakop] -= 1
+    further_mortgage[nakop] -= 1
+    now_mortgage[nakop] -= 1
+    rate = np.where(nakop, return_mortgage[:, None], return_mortgage_init[:, None])
+    return np.where(active, rate, bank_rate)
+
+
+def _option_returns(choices, new_assets, total, k):
+    n_games = choices.shape[0]
+    flat = (np.arange(n_games)[:, None, None] * k + choices).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = (new_assets / (total[:, :, None] / 3) - 1).ravel()
+        sums = np.bincount(flat, weights=returns, minlength=n_games * k)
+        counts = np.bincount(flat, minlength=n_games * k)
+        return (sums / counts).reshape(n_games, k)
+
+
+def _option_popularity(choices, k):
+    n_games = choices.shape[0]
+    flat = (np.arange(n_games)[:, None, None] * k + choices).ravel()
+    counts = np.bincount(flat, minlength=n_games * k).reshape(n_games, k)
+    return counts / counts.sum(axis=1, keepdims=True)
+
+
+def _play_batch_star(args):
+    return play_batch(*args)
+
+
+def simulate(n_games, n_players, n_years, strategies, rules=None, seed=0, batch_size=2000, workers=None,
+             initial_asset=100.0):
+    '''
+    N игр × M игроков × Y лет. Игры режутся на партии по batch_size и раздаются по пулу процессов
+    :param strategies: dict name -> Strategy или name -> (Strategy, доля игроков)
+    :param workers: число процессов, None - по числу ядер, 1 - без пула
+    :return: SimulationResult
+    '''
+    sizes = [batch_size] * (n_games // batch_size)
+    if n_games % batch_size:
+        sizes.append(n_games % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(size, n_players, n_years, strategies, rules, seed_, initial_asset)
+             for size, seed_ in zip(sizes, seeds)]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(tasks) == 1:
+        results = map(_play_batch_star, tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_play_batch_star, tasks))
+    result = None
+    for batch in results:
+        result = batch if result is None else result.merge(batch)
+    return result
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from cache import ResponseCache
+from persistence import MemoryBackend
+from repository import Factory
+
+
+class SlowFill:
+    '''
+    fill, который считает, пока его не отпустят
+    '''
+
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+def race(cache, fill, readers=8):
+    '''
+    Один читатель считает запись, остальные приходят, пока он считает
+    :return: результаты читателей - значения или исключения
+    '''
+    results = [None] * readers
+
+    def read(i):
+        try:
+            results[i] = cache.get('A', 1, 'top', fill)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    threads[0].start()
+    assert fill.started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.misses < readers:  # остальные уже ждут запись
+        pass
+    fill.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_misses_fill_once():
+    cache = ResponseCache()
+    fill = SlowFill([1, 2, 3])
+    results = race(cache, fill)
+    assert fill.calls == 1
+    assert all(result is fill.value for result in results)
+    assert cache.get('A', 1, 'top', fill) is fill.value
+    assert fill.calls == 1 and cache.hits == 1
+
+
+def test_fill_error_reaches_every_waiter():
+    cache = ResponseCache()
+    fill = SlowFill(ValueError('boom'))
+    results = race(cache, fill)
+    assert fill.calls == 1
+    assert all(result is fill.value for result in results)
+    assert len(cache) == 0
+    assert cache.get('A', 1, 'top', lambda: 'ok') == 'ok'  # ошибка не закешировалась
+
+
+def test_new_generation_drops_old_entries():
+    cache = ResponseCache()
+    cache.get('A', 1, 'top', lambda: 'old top')
+    cache.get('A', 1, 'history', lambda: 'old history')
+    cache.get('B', 1, 'top', lambda: 'b')
+    assert cache.get('A', 2, 'top', lambda: 'new top') == 'new top'
+    assert len(cache) == 2
+    assert cache.get('A', 1, 'history', lambda: 'late') == 'late'  # запоздавший читатель не пишет в кеш
+    assert len(cache) == 2
+    assert cache.get('B', 1, 'top', lambda: 'miss') == 'b'
+
+
+def test_entries_are_bounded_by_lru():
+    cache = ResponseCache(max_entries=3)
+    for request in range(3):
+        cache.get('A', 1, request, lambda: request)
+    cache.get('A', 1, 0, lambda: 'miss')  # 0 теперь недавний
+    cache.get('A', 1, 3, lambda: 3)
+    assert len(cache) == 3
+    assert cache.get('A', 1, 1, lambda: 'evicted') == 'evicted'
+    assert cache.get('A', 1, 0, lambda: 'miss') == 0
+
+
+def test_factory_cache_follows_gamble(tmp_path):
+    backend = MemoryBackend([dict(ID=i + 1, Name=str(i), Active_a=100.0 + i, Active_b=50.0, Active_c=70.0)
+                             for i in range(3)], day=2)
+    factory = Factory(backend=backend, spill_dir=str(tmp_path))
+    years = []
+    assert factory.cached('A', 'year', lambda repo: years.append(repo.year) or repo.year) == 0
+    assert factory.cached('A', 'year', lambda repo: pytest.fail('cache miss')) == 0
+    repo = factory.get_repository('A')
+    repo.Choice(1, ['bank'] * 3, ['bank'] * 3, ['bank'] * 3)
+    repo.Gamble(1)
+    assert factory.cached('A', 'year', lambda repo: years.append(repo.year) or repo.year) == 1
+    assert years == [0, 1]
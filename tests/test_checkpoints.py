@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from checkpoints import CheckpointStore
+from persistence import MemoryBackend
+from repository import Repository
+
+OPTIONS = ['bank', 'sosed', 'korp_bond', 'gov_bond', 'stock_together', 'stock_only', 'stock_index', 'mortgage',
+           'education']
+
+
+def roster(n):
+    return MemoryBackend([dict(ID=i + 1, Name=str(i), Active_a=100.0 + i, Active_b=50.0, Active_c=70.0)
+                          for i in range(n)], day=2)
+
+
+def choices(year, n):
+    rng = np.random.default_rng(year)
+    return [[OPTIONS[i] for i in rng.integers(0, len(OPTIONS), n)] for _ in range(3)]
+
+
+def play(repo, years):
+    n = len(repo.data)
+    for year in years:
+        repo.Choice(year, *choices(year, n))
+        repo.Gamble(year)
+    return repo
+
+
+def test_numpy_seed_and_year(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    repo = Repository(None, backend=roster(20), seed=np.int64(3), checkpoints=store)
+    play(repo, np.arange(1, 4))
+    assert store.years() == [1, 2, 3]
+    restored = store.load(backend=roster(20))
+    assert restored.seed == 3 and restored.data.equals(repo.data)
+    for game in (repo, restored):
+        play(game, [4])
+    assert restored.data.equals(repo.data)
+
+
+@pytest.mark.parametrize('seed', [-1, 1.5, True, '3'])
+def test_bad_seed(seed):
+    with pytest.raises(ValueError):
+        Repository(None, backend=roster(3), seed=seed)
+
+
+def test_failed_checkpoint_does_not_fail_the_round(tmp_path):
+    (tmp_path / 'game').write_text('not a directory')
+    repo = Repository(None, backend=roster(5), seed=1, checkpoints=CheckpointStore(str(tmp_path / 'game')))
+    play(repo, [1])
+    assert repo.year == 1
+
+
+def test_counterfactuals_survive_restore(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    repo = play(Repository(None, backend=roster(30), seed=5, checkpoints=store), [1, 2, 3])
+    restored = store.load(backend=roster(30))
+    for year in (1, 2, 3):
+        assert np.array_equal(restored.counterfactual(year), repo.counterfactual(year))
+    for game in (repo, restored):
+        play(game, [4])
+    assert np.array_equal(restored.counterfactual(4), repo.counterfactual(4))
+
+
+def test_round_aggregates_survive_restore(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    repo = play(Repository(None, backend=roster(30), seed=5, checkpoints=store), [1, 2, 3])
+    restored = store.load(backend=roster(30))
+    assert restored.aggregates.summary() == repo.aggregates.summary()
+    assert restored.aggregates.summary()['popularity'] is not None
+    for year in (1, 2, 3):
+        assert np.array_equal(restored.aggregates.rounds[year].counts, repo.aggregates.rounds[year].counts)
+    for game in (repo, restored):
+        play(game, [4])
+    assert restored.aggregates.summary() == repo.aggregates.summary()
@@ -0,0 +1,70 @@
+'''
+Векторный режим начисления (_accrue_vector_) должен совпадать со старым проходом по опциям (engine='loop')
+бит в бит: те же розыгрыши в том же порядке, откат на банк для неизвестных опций, нулевой актив для пропусков.
+GOLDEN посчитан кодом движка до векторного режима.
+'''
+import numpy as np
+import pytest
+
+from persistence import MemoryBackend
+from repository import Repository
+
+OPTS = ['bank', 'sosed', 'korp_bond', 'gov_bond', 'stock_together', 'stock_only', 'stock_index',
+        'mortgage', 'education', 'lottery', None]
+UNIFORM = [1] * 11
+MORTGAGE_HEAVY = [1, 1, 1, 1, 0.2, 1, 1, 6, 1, 0.3, 0.3]
+
+# 12 игроков, 8 лет, MORTGAGE_HEAVY, seed 7: TOTAL, mortgage_count, educ после 8-го года
+GOLDEN_TOTAL = [195.74380535693322, 212.72425976454127, 301.83551795203607, 308.68684471999694,
+                309.17083065277853, 205.3145522745741, 337.1252512789095, 211.78453302142054, 214.2688085239338,
+                217.62305554317564, 348.4233289173883, 233.1741114736517]
+GOLDEN_MORTGAGE_COUNT = [1, 0, 0, 3, 4, 1, 1, 0, 0, 0, 2, 1]
+GOLDEN_EDUC = [3, 1, 0, 2, 2, 2, 0, 1, 3, 1, 2, 1]
+
+
+def play(n, years, game, weights, **kwargs):
+    '''
+    Выборы из RandomState(game + 1000); без seed в kwargs перед Gamble года y - np.random.seed(game * 100 + y)
+    '''
+    backend = MemoryBackend([dict(ID=i + 1, Name=str(i), Active_a=100 + i, Active_b=50, Active_c=70 + 2 * i)
+                             for i in range(n)])
+    repo = Repository(None, backend=backend, **kwargs)
+    rs = np.random.RandomState(game + 1000)
+    p = np.array(weights, float) / sum(weights)
+    for year in range(1, years + 1):
+        repo.Choice(year, *[[OPTS[i] for i in rs.choice(len(OPTS), size=n, p=p)] for _ in range(3)])
+        if 'seed' not in kwargs:
+            np.random.seed(game * 100 + year)
+        repo.Gamble(year)
+    return repo
+
+
+def assert_same(a, b):
+    assert a.more_than_40 == b.more_than_40
+    for column in a.data.columns:
+        if a.data[column].dtype.kind in 'iuf':
+            assert np.array_equal(a.data[column].to_numpy(float), b.data[column].to_numpy(float),
+                                  equal_nan=True), column
+        else:
+            assert a.data[column].astype(object).equals(b.data[column].astype(object)), column
+
+
+@pytest.mark.parametrize('engine', ['vector', 'loop'])
+def test_golden(engine):
+    repo = play(12, 8, 7, MORTGAGE_HEAVY, engine=engine)
+    assert repo.data['TOTAL'].tolist() == GOLDEN_TOTAL
+    assert repo.data['mortgage_count'].tolist() == GOLDEN_MORTGAGE_COUNT
+    assert repo.data['educ'].tolist() == GOLDEN_EDUC
+    assert not repo.more_than_40
+
+
+@pytest.mark.parametrize('weights', [UNIFORM, MORTGAGE_HEAVY])
+@pytest.mark.parametrize('seed', range(10))
+def test_vector_matches_loop(seed, weights):
+    assert_same(play(40, 10, seed, weights, engine='loop'), play(40, 10, seed, weights, engine='vector'))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_vector_matches_loop_seeded(seed):
+    assert_same(play(40, 10, seed, MORTGAGE_HEAVY, engine='loop', seed=seed),
+                play(40, 10, seed, MORTGAGE_HEAVY, engine='vector', seed=seed))
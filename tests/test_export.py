@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from checkpoints import CheckpointStore
+from export import COLUMNS, export, iter_chunks
+from repository import Repository
+from test_checkpoints import play, roster
+
+PLAYERS, YEARS = 7, [1, 2, 3]
+
+
+def game(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints'))
+    return play(Repository(None, backend=roster(PLAYERS), seed=3, checkpoints=store), YEARS), store
+
+
+def test_csv_from_live_game_matches_checkpoint(tmp_path):
+    repo, store = game(tmp_path)
+    live, saved = str(tmp_path / 'live.csv'), str(tmp_path / 'saved.csv')
+    assert export(repo, live, chunk_size=3) == PLAYERS * len(YEARS) * 3
+    assert export(store, saved, chunk_size=3) == PLAYERS * len(YEARS) * 3
+    frame = pd.read_csv(live)
+    assert list(frame.columns) == list(COLUMNS)
+    assert len(frame) == PLAYERS * len(YEARS) * 3
+    pd.testing.assert_frame_equal(frame, pd.read_csv(saved))
+    last = frame[(frame['year'] == 3) & (frame['slot'] == 1)].set_index('player')['total']
+    assert last.to_dict() == pytest.approx(repo.data['TOTAL_year_3_for_dohod'].to_dict())
+
+
+def test_chunks_do_not_depend_on_chunk_size(tmp_path):
+    repo, _ = game(tmp_path)
+    whole = pd.concat(list(iter_chunks(repo)), ignore_index=True)
+    pd.testing.assert_frame_equal(pd.concat(list(iter_chunks(repo, chunk_size=2)), ignore_index=True), whole)
+
+
+def test_parquet_matches_csv(tmp_path):
+    pytest.importorskip('pyarrow')
+    repo, store = game(tmp_path)
+    path, csv = str(tmp_path / 'game.parquet'), str(tmp_path / 'game.csv')
+    assert export(store, path, chunk_size=3) == PLAYERS * len(YEARS) * 3
+    export(repo, csv)
+    pd.testing.assert_frame_equal(pd.read_parquet(path), pd.read_csv(csv), check_dtype=False)
+
+
+def test_unknown_format(tmp_path):
+    repo, _ = game(tmp_path)
+    with pytest.raises(ValueError):
+        export(repo, str(tmp_path / 'game.xlsx'))
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pytest
+
+from ingestion import RoundCollector
+from persistence import MemoryBackend
+from repository import OPTIONS, Repository
+
+N = 40
+
+
+def make_game():
+    return Repository(None, backend=MemoryBackend([dict(ID=i + 1, Name=str(i), Active_a=100.0, Active_b=50.0,
+                                                        Active_c=70.0) for i in range(N)], day=2), seed=1)
+
+
+def recorder():
+    '''
+    play, который только запоминает, с чем его вызвали
+    '''
+    calls = []
+
+    def play(year, *choices):
+        calls.append((year,) + choices)
+        return 'played'
+    return play, calls
+
+
+def test_concurrent_submits_match_a_serial_round():
+    rng = np.random.default_rng(8)
+    picks = [tuple(OPTIONS[k] for k in rng.integers(len(OPTIONS), size=3)) for _ in range(N)]
+    serial = make_game()
+    serial.Choice(1, *[[pick[asset] for pick in picks] for asset in range(3)])
+    serial.Gamble(1)
+    repo = make_game()
+    collector = RoundCollector(repo, 1)
+    closed = []
+
+    def send(players):
+        for player_id in players:
+            closed.append(collector.submit(player_id, 1, *picks[player_id - 1]))
+
+    threads = [threading.Thread(target=send, args=(range(start + 1, N + 1, 4),)) for start in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert closed.count(True) == 1
+    collector.result.result(timeout=30)
+    assert collector.submitted == N
+    assert np.array_equal(repo.data['TOTAL'].to_numpy(), serial.data['TOTAL'].to_numpy())
+    assert collector.counts.sum() == 3 * N
+
+
+def test_resubmission_replaces_the_earlier_choice():
+    play, calls = recorder()
+    collector = RoundCollector(make_game(), 1, play=play)
+    collector.submit(1, 1, 'bank', 'sosed', 'bank')
+    collector.submit(1, 1, 'bank', 'bank', 'bank')
+    assert collector.submitted == 1
+    assert collector.counts.sum() == 3
+    assert collector.counts[1, OPTIONS.index('sosed')] == 0
+    assert collector.counts[1, OPTIONS.index('bank')] == 1
+    assert collector.pending() == list(range(2, N + 1))
+
+
+def test_bad_submissions_are_rejected():
+    collector = RoundCollector(make_game(), 1, play=recorder()[0])
+    with pytest.raises(ValueError):
+        collector.submit(1, 1, 'bank', 'lottery', 'bank')
+    with pytest.raises(ValueError):
+        collector.submit(N + 1, 1, 'bank', 'bank', 'bank')
+    with pytest.raises(ValueError):
+        collector.submit(1, 2, 'bank', 'bank', 'bank')
+    with pytest.raises(ValueError):
+        RoundCollector(make_game(), 1, default=('bank', 'bank', 'lottery'))
+    assert collector.submitted == 0 and not collector.counts.any()
+
+
+def test_round_closes_on_the_last_player():
+    play, calls = recorder()
+    collector = RoundCollector(make_game(), 1, play=play)
+    for player_id in range(1, N):
+        assert not collector.submit(player_id, 1, 'bank', 'bank', 'sosed')
+    assert collector.submit(N, 1, 'sosed', 'bank', 'bank')
+    assert collector.closed and collector.result.result(timeout=5) == 'played'
+    year, first, second, third = calls[0]
+    assert year == 1 and first[-1] == 'sosed' and third[:-1] == ['sosed'] * (N - 1)
+    with pytest.raises(RuntimeError):
+        collector.submit(1, 1, 'bank', 'bank', 'bank')
+
+
+def test_deadline_fills_missing_players_with_default():
+    play, calls = recorder()
+    collector = RoundCollector(make_game(), 1, deadline=0.1, default=('sosed', 'bank', 'bank'), play=play)
+    collector.submit(2, 1, 'bank', 'bank', 'bank')
+    assert collector.result.result(timeout=5) == 'played'
+    _, first, _, _ = calls[0]
+    assert first[1] == 'bank'
+    assert first[:1] + first[2:] == ['sosed'] * (N - 1)
+    assert len(calls) == 1
+
+
+def test_play_error_goes_to_result():
+    def play(year, *choices):
+        raise KeyError('no such year')
+
+    collector = RoundCollector(make_game(), 1, play=play)
+    with pytest.raises(KeyError):
+        collector.close().result(timeout=5)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from market import ScenarioTape, SeededShocks, SHOCKS
+from repository import Repository
+from test_checkpoints import choices, play, roster
+
+
+def test_tape_matches_seeded_scalar_shocks(tmp_path):
+    tape = ScenarioTape.write(str(tmp_path / 'tape.npy'), 3, seed=5)
+    for year in (1, 2, 3):
+        seeded, taped = SeededShocks(5, year), tape.shocks(year)
+        for slot in (1, 2, 3):
+            assert [taped.draw(slot, name) for name in SHOCKS] == [seeded.draw(slot, name) for name in SHOCKS]
+
+
+def test_short_tape_fails_before_touching_data(tmp_path):
+    tape = ScenarioTape.write(str(tmp_path / 'tape.npy'), 1, seed=5)
+    repo = play(Repository(None, backend=roster(4), tape=tape), [1])
+    repo.Choice(2, *choices(2, 4))
+    before = repo.data.copy()
+    with pytest.raises(ValueError, match='1..1'):
+        repo.Gamble(2)
+    assert list(repo.data.columns) == list(before.columns)
+    assert repo.data.equals(before)
+    assert repo.year == 1 and 2 not in repo.history.years
+    assert np.array_equal(repo.data['TOTAL'].to_numpy(), before['TOTAL'].to_numpy())
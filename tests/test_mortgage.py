@@ -0,0 +1,42 @@
+'''
+Свойство: mortgage.MortgageLedger (векторный режим) двигает счетчики ипотеки и выбирает NAKOP/START так же,
+как старые mortgage/accrue_mortgage/checker_for_mortgage (engine='loop'), включая откат на банк из-за
+KeyError в checker_for_mortgage. Стартовые счетчики случайные, ипотека встречается во всех трех активах.
+'''
+import numpy as np
+import pytest
+
+from persistence import MemoryBackend
+from repository import Repository
+
+OPTIONS = ['bank', 'mortgage', 'mortgage', 'mortgage', 'sosed', 'education']
+COLUMNS = ('TOTAL', 'asset_1_1', 'asset_1_2', 'asset_1_3', 'mortgage_count', 'further_mortgage', 'now_mortgage',
+           'educ')
+
+
+def random_game(case):
+    rng = np.random.default_rng(case)
+    n = int(rng.integers(1, 12))
+    players = [dict(ID=i + 1, Name=str(i), Active_a=100.0, Active_b=50.0, Active_c=70.0,
+                    Mortgage_count=int(rng.integers(0, 4)) * int(rng.random() < 0.6),
+                    Now_mortgage=int(rng.integers(0, 4)), Further_mortgage=0)  # further на начало года всегда 0
+               for i in range(n)]
+    choices = [[OPTIONS[i] for i in rng.integers(0, len(OPTIONS), n)] for _ in range(3)]
+    return players, choices
+
+
+def play(players, choices, engine, case):
+    repo = Repository(None, backend=MemoryBackend(players), engine=engine)
+    repo.Choice(1, *choices)
+    np.random.seed(case)
+    repo.Gamble(1)
+    return repo.data
+
+
+@pytest.mark.parametrize('case', range(300))
+def test_ledger_matches_loop_engine(case):
+    players, choices = random_game(case)
+    loop = play(players, choices, 'loop', case)
+    vector = play(players, choices, 'vector', case)
+    for column in COLUMNS:
+        assert np.array_equal(loop[column].to_numpy(float), vector[column].to_numpy(float)), column
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from checkpoints import CheckpointStore
+from repository import Repository
+from schema import CHOICE_DTYPE, COUNTER_DTYPE, StateSchema
+from test_checkpoints import choices, play, roster
+
+
+def test_strict_choice_leaves_no_half_round():
+    repo = Repository(None, backend=roster(3), seed=1, schema=StateSchema(strict=True))
+    with pytest.raises(ValueError, match='lottery'):
+        repo.Choice(1, ['bank'] * 3, ['bank'] * 3, ['bank', 'lottery', 'bank'])
+    assert not [column for column in repo.data if column.startswith('year_1_')]
+    repo.Choice(1, *choices(1, 3))
+    assert all(repo.data[f'year_1_{slot}'].dtype == CHOICE_DTYPE for slot in (1, 2, 3))
+
+
+def test_lenient_choice_keeps_unknown_as_a_category():
+    repo = Repository(None, backend=roster(3), seed=1)
+    repo.Choice(1, ['bank'] * 3, ['bank'] * 3, ['bank', 'lottery', 'bank'])
+    assert list(repo.data['year_1_3']) == ['bank', 'unknown', 'bank']
+
+
+def check_dtypes(data):
+    schema = StateSchema('float32')
+    for column, dtype in data.dtypes.items():
+        expected = schema.dtype(column)
+        if expected is not None:
+            assert dtype == expected, column
+    assert data['TOTAL'].dtype == np.float32
+    assert data['educ'].dtype == COUNTER_DTYPE
+
+
+def test_float32_survives_gamble_and_checkpoints(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    repo = play(Repository(None, backend=roster(6), seed=2, schema=StateSchema('float32'), checkpoints=store),
+                [1, 2])
+    check_dtypes(repo.data)
+    assert repo.data['asset_2_1'].dtype == np.float32
+    restored = store.load(backend=roster(6))
+    assert restored.schema.float_dtype == np.float32
+    check_dtypes(restored.data)
+    assert restored.data.dtypes.equals(repo.data.dtypes)
+    assert np.array_equal(restored.data['TOTAL'].to_numpy(), repo.data['TOTAL'].to_numpy())
+    play(restored, [3])
+    play(repo, [3])
+    check_dtypes(restored.data)
+    assert np.array_equal(restored.data['TOTAL'].to_numpy(), repo.data['TOTAL'].to_numpy())
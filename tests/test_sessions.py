@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from persistence import MemoryBackend
+from repository import Factory
+
+
+def roster(n, base=100.0):
+    return MemoryBackend([dict(ID=i + 1, Name=str(i), Active_a=base + i, Active_b=50.0, Active_c=70.0)
+                          for i in range(n)], day=2)
+
+
+def test_games_get_their_own_backends(tmp_path):
+    backends = {'A': roster(3), 'B': roster(5, base=10.0)}
+    factory = Factory(backend_for=backends.__getitem__, spill_dir=str(tmp_path))
+    a = factory.get_repository('A')
+    b = factory.get_repository('B')
+    assert list(a.data.index) == [1, 2, 3]
+    assert list(b.data.index) == [1, 2, 3, 4, 5]
+    a.Choice(1, ['bank'] * 3, ['bank'] * 3, ['bank'] * 3)
+    a.Gamble(1)
+    factory.sessions.close()
+    assert backends['B'].players[0]['Active_a'] == 10.0
+    assert backends['A'].players[0]['Active_a'] != 100.0
+
+
+def test_shared_backend_is_refused_for_a_second_game(tmp_path):
+    factory = Factory(backend=roster(3), spill_dir=str(tmp_path))
+    factory.get_repository('A')
+    with pytest.raises(ValueError):
+        factory.get_repository('B')
+
+
+def test_held_reference_survives_eviction(tmp_path):
+    backends = {'A': roster(3), 'B': roster(3)}
+    factory = Factory(backend_for=backends.__getitem__, max_games=1, spill_dir=str(tmp_path))
+    a = factory.get_repository('A')
+    factory.get_repository('B')
+    assert 'A' in factory.sessions and len(factory.sessions) == 1
+    a.Choice(1, ['bank'] * 3, ['bank'] * 3, ['bank'] * 3)
+    a.Gamble(1)
+    assert a.year == 1
+    assert factory.get_repository('A').year == 1
+    factory.get_repository('B')
+    assert backends['A'].players[0]['Active_a'] != 100.0
+
+
+def test_instrumented_game_can_be_evicted(tmp_path):
+    from metrics import EngineMetrics
+    from sessions import SessionManager
+    from repository import Repository
+
+    metrics = EngineMetrics()
+    backends = {'A': roster(3), 'B': roster(3)}
+    sessions = SessionManager(lambda game_id: Repository(game_id, backend=backends[game_id], metrics=metrics),
+                              max_games=1, spill_dir=str(tmp_path))
+    sessions.choice('A', 1, ['bank'] * 3, ['sosed'] * 3, ['bank'] * 3)
+    sessions.gamble('A', 1)
+    sessions.get('B')
+    assert len(sessions) == 1
+    assert sessions.get('A').metrics is metrics
+    assert metrics.rounds_total == 1
+
+
+def test_game_spilled_by_another_manager_is_restored(tmp_path):
+    from sessions import SessionManager
+    from repository import Repository
+
+    backends = {'A': roster(3)}
+    first = SessionManager(lambda game_id: Repository(game_id, backend=backends[game_id]), spill_dir=str(tmp_path))
+    first.choice('A', 1, ['bank'] * 3, ['bank'] * 3, ['bank'] * 3)
+    first.gamble('A', 1)
+    first.evict('A')
+    path = first._spill_path('A')
+
+    def broken(game_id):
+        raise RuntimeError('no backend')
+
+    with pytest.raises(RuntimeError):
+        SessionManager(broken, spill_dir=str(tmp_path)).get('A')
+    assert os.path.exists(path)
+    second = SessionManager(lambda game_id: Repository(game_id, backend=roster(3)), spill_dir=str(tmp_path))
+    assert second.get('A').year == 1
+    assert not os.path.exists(path)
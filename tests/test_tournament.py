@@ -0,0 +1,113 @@
+import glob
+import os
+import signal
+import time
+import uuid
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pytest
+
+from benchmark import make_choices
+from persistence import MemoryBackend
+from repository import Repository
+from tournament import SharedState, Tournament
+
+N = 200
+
+
+def make_game(game_id):
+    return Repository(None, backend=MemoryBackend([dict(ID=i + 1, Name=str(i), Active_a=100.0, Active_b=50.0,
+                                                        Active_c=70.0) for i in range(N)], day=2), seed=game_id)
+
+
+def exit_at_open(game_id):
+    os._exit(3)
+
+
+def slow_open(game_id):
+    time.sleep(3)
+    return make_game(game_id)
+
+
+def choices(game_id, year):
+    return make_choices(np.random.default_rng(game_id * 100 + year), 'uniform', N)
+
+
+def test_read_gives_up_on_a_torn_write():
+    name = f'freezy_test_{uuid.uuid4().hex[:8]}'
+    state = SharedState(name, N, create=True)
+    state.header[0] += 1  # писатель умер посреди записи
+    with pytest.raises(TimeoutError):
+        state.read(timeout=0.05)
+    again = SharedState(name, N, create=True)  # перезапущенный воркер
+    again.write(3, make_game(0).data)
+    assert state.read()[0] == 3
+    for shared in (again, state):
+        shared.close()
+    SharedMemory(name).unlink()
+
+
+def test_tournament_matches_serial_run_after_worker_crash(tmp_path):
+    games, years = [1, 2, 3, 4], [1, 2, 3]
+    serial = {}
+    for game_id in games:
+        repo = make_game(game_id)
+        for year in years:
+            repo.Choice(year, *choices(game_id, year))
+            repo.Gamble(year)
+        serial[game_id] = repo
+    with Tournament(games, str(tmp_path), create=make_game, workers=2, max_pending=3) as tournament:
+        futures = []
+        for year in years:
+            futures += [tournament.submit(game_id, year, *choices(game_id, year)) for game_id in games]
+            if year == 2:
+                os.kill(tournament._workers[1].pid, signal.SIGKILL)
+        for future in futures:
+            future.result(timeout=120)
+        assert tournament.restarts >= 1
+        for game_id in games:
+            year, state = tournament.state(game_id)
+            assert year == 3
+            assert np.array_equal(state['TOTAL'], serial[game_id].data['TOTAL'].to_numpy(float))
+            assert tournament.leaderboard(game_id).top(5) == serial[game_id].leaderboard.top(5)
+            assert tournament.aggregates(game_id).summary() == serial[game_id].aggregates.summary()
+
+
+def test_unknown_game_does_not_take_a_slot(tmp_path):
+    with Tournament([1], str(tmp_path), create=make_game, workers=1, max_pending=1) as tournament:
+        with pytest.raises(KeyError):
+            tournament.submit(99, 1, *choices(1, 1))
+        assert tournament.submit(1, 1, *choices(1, 1)).result(timeout=60) == (1, False)
+
+
+def test_game_that_cannot_reopen_fails_its_rounds(tmp_path):
+    with Tournament([1, 2], str(tmp_path), create=make_game, workers=1, max_pending=2) as tournament:
+        for game_id in (1, 2):
+            tournament.submit(game_id, 1, *choices(game_id, 1)).result(timeout=60)
+        for path in glob.glob(os.path.join(str(tmp_path), '1', '*.npz')):
+            with open(path, 'wb') as file:
+                file.write(b'not a checkpoint')
+        os.kill(tournament._workers[0].pid, signal.SIGKILL)
+        try:
+            future = tournament.submit(1, 2, *choices(1, 2))
+        except RuntimeError:  # 'broken' уже пришел
+            pass
+        else:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=60)
+        with pytest.raises(RuntimeError):
+            tournament.submit(1, 3, *choices(1, 3))
+        assert tournament.submit(2, 2, *choices(2, 2)).result(timeout=60) == (2, False)
+        assert tournament._slots._value == 2
+        assert tournament.restarts == 1
+
+
+def test_worker_that_keeps_crashing_is_given_up(tmp_path):
+    with pytest.raises(RuntimeError, match='crashed 2 times'):
+        Tournament([1], str(tmp_path), create=exit_at_open, workers=1, max_restarts=1)
+
+
+def test_start_timeout(tmp_path):
+    with pytest.raises(TimeoutError):
+        Tournament([1], str(tmp_path), create=slow_open, workers=1, start_timeout=0.5)
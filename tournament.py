@@ -0,0 +1,405 @@
+'''
+Турнир: много независимых игр на пуле процессов.
+
+Каждая игра закреплена за одним воркером - ее раунды идут по порядку, а разные игры считаются параллельно.
+Числовое состояние игроков (TOTAL, активы, educ, счетчики ипотеки) воркер после каждого Gamble кладет в
+разделяемую память игры, и координатор строит рейтинг и агрегаты прямо из нее, без пересылки датафреймов.
+Раундов в работе одновременно не больше max_pending: submit ждет, пока освободится место.
+Каждая игра пишет контрольные точки (checkpoints.CheckpointStore); если воркер упал, он перезапускается,
+поднимает свои игры с последних точек и доигрывает раунды, которые не успел закончить. Воркер, упавший больше
+max_restarts раз, больше не поднимается: его раунды и игры завершаются с ошибкой.
+
+    with Tournament(range(40), '/var/lib/freezy/event', create=make_game, workers=8) as tournament:
+        futures = [tournament.submit(game_id, 1, *choices[game_id]) for game_id in range(40)]
+        ...
+        tournament.leaderboard(3).top(10)
+
+create должен быть функцией уровня модуля (воркеры запускаются через spawn).
+'''
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+SHARED_FIELDS = ('TOTAL', 'asset_1', 'asset_2', 'asset_3', 'educ', 'mortgage_count', 'further_mortgage',
+                 'now_mortgage')
+HEADER = 3  # int64: счетчик записей (нечетный - идет запись), год, число игроков в раунде (0 - раунда нет)
+N_OPTIONS = 9  # len(repository.OPTIONS), без импорта движка
+
+
+class SharedState:
+    '''
+    Состояние игроков одной игры в разделяемой памяти: заголовок, матрица SHARED_FIELDS × игроки и выборы
+    последнего раунда из aggregates (counts и invested, 2 × 3 × опции), все float64.
+    Пишет только воркер игры, читать можно откуда угодно (seqlock: читатель повторяет чтение, если попал
+    на запись)
+    '''
+
+    def __init__(self, name, n_players, create=False):
+        size = 8 * (HEADER + len(SHARED_FIELDS) * max(n_players, 1) + 2 * 3 * N_OPTIONS)
+        if create:
+            try:
+                self.memory = SharedMemory(name, create=True, size=size)
+            except FileExistsError:  # блок остался от упавшего воркера
+                self.memory = _attach(name)
+        else:
+            self.memory = _attach(name)
+        self.n_players = n_players
+        self.header = np.ndarray(HEADER, dtype=np.int64, buffer=self.memory.buf)
+        self.values = np.ndarray((len(SHARED_FIELDS), n_players), dtype=np.float64, buffer=self.memory.buf,
+                                 offset=8 * HEADER)
+        self.round = np.ndarray((2, 3, N_OPTIONS), dtype=np.float64, buffer=self.memory.buf,
+                                offset=8 * (HEADER + len(SHARED_FIELDS) * n_players))
+        if create and self.header[0] % 2:  # прошлый воркер упал посреди записи - следующая write все перепишет
+            self.header[0] += 1
+
+    def write(self, year, data, round_=None):
+        '''
+        :param data: Repository.data после Gamble года year
+        :param round_: aggregates.RoundAggregates этого года, None - раунда нет
+        '''
+        columns = ['TOTAL', f'asset_{year}_1', f'asset_{year}_2', f'asset_{year}_3'] + list(SHARED_FIELDS[4:])
+        values = data.reindex(columns=columns).to_numpy(dtype=np.float64).T  # до первого раунда активов нет
+        self.header[0] += 1
+        self.values[:] = values
+        self.header[1] = year
+        self.header[2] = 0 if round_ is None else round_.players
+        if round_ is not None:
+            self.round[0], self.round[1] = round_.counts, round_.invested
+        self.header[0] += 1
+
+    def read(self, timeout=1.0):
+        '''
+        :param timeout: сколько секунд ждать, пока воркер допишет состояние
+        :return: (год, копия матрицы SHARED_FIELDS × игроки, aggregates.RoundAggregates последнего раунда или None)
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            before = int(self.header[0])
+            if not before % 2:
+                year, players = int(self.header[1]), int(self.header[2])
+                values, round_ = self.values.copy(), self.round.copy()
+                if int(self.header[0]) == before:
+                    break
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'{self.memory.name} is being written for more than {timeout}s')
+            time.sleep(0.0005)
+        if not players:
+            return year, values, None
+        from aggregates import RoundAggregates
+
+        return year, values, RoundAggregates(round_[0].astype(np.int64), round_[1], players)
+
+    def close(self):
+        self.header = self.values = None
+        self.memory.close()
+
+
+def _attach(name):
+    memory = SharedMemory(name)
+    # блок создал другой процесс и он же его удалит - иначе resource_tracker удалит его второй раз при выходе
+    resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+class Tournament:
+    '''
+    :param game_ids: айдишники игр
+    :param directory: папка для контрольных точек, по подпапке на игру
+    :param create: функция game_id -> Repository для новой игры, по умолчанию Repository(game_id)
+    :param backend: хранилище игроков для игр, поднятых из контрольных точек
+    :param workers: число процессов, по умолчанию os.cpu_count()
+    :param max_pending: сколько раундов может быть в работе одновременно, по умолчанию 4 на воркер
+    :param max_restarts: сколько раз перезапускать один воркер
+    :param start_timeout: сколько секунд ждать, пока воркеры откроют игры
+    '''
+
+    def __init__(self, game_ids, directory, create=None, backend=None, workers=None, max_pending=None,
+                 context='spawn', max_restarts=3, start_timeout=60):
+        self.game_ids = list(game_ids)
+        self.directory = directory
+        self.create = create
+        self.backend = backend
+        self.n_workers = max(1, min(workers or os.cpu_count() or 1, len(self.game_ids)))
+        self._context = multiprocessing.get_context(context)
+        self._prefix = f'freezy_{os.getpid()}_{id(self):x}'
+        self.assignment = {game_id: i % self.n_workers for i, game_id in enumerate(self.game_ids)}
+        self._index = {game_id: i for i, game_id in enumerate(self.game_ids)}
+        self._slots = threading.BoundedSemaphore(max_pending or 4 * self.n_workers)
+        self._task_ids = itertools.count()
+        self._pending = {}  # task_id -> (воркер, сообщение, Future)
+        self._opened = {}  # game_id -> Future открытия игры
+        self.states = {}  # game_id -> SharedState
+        self.player_ids = {}  # game_id -> айдишники игроков в порядке колонок SharedState
+        self._broken = {}  # game_id -> почему игра недоступна
+        self.restarts = 0
+        self.max_restarts = max_restarts
+        self._worker_restarts = [0] * self.n_workers
+        self._dead = set()  # воркеры, которые больше не перезапускаются
+        self._lock = threading.Lock()
+        self._workers = [None] * self.n_workers
+        self._tasks = [None] * self.n_workers
+        self._results = [None] * self.n_workers  # у каждого воркера своя труба: упавший не заблокирует остальных
+        self._closed = False
+        for worker in range(self.n_workers):
+            self._start(worker)
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        deadline = time.monotonic() + start_timeout
+        try:
+            for game_id, future in list(self._opened.items()):
+                try:
+                    future.result(timeout=max(deadline - time.monotonic(), 0))
+                except TimeoutError:
+                    raise TimeoutError(f'game {game_id!r} was not opened in {start_timeout}s') from None
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self, worker):
+        '''
+        Запускает (или перезапускает) воркер и открывает в нем его игры
+        '''
+        tasks = self._context.Queue()
+        results, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_worker_main, args=(tasks, sender, self.directory, self.create,
+                                                                   self.backend), daemon=True)
+        process.start()
+        sender.close()
+        self._workers[worker], self._tasks[worker], self._results[worker] = process, tasks, results
+        for game_id in self.game_ids:
+            if self.assignment[game_id] == worker:
+                self._opened.setdefault(game_id, Future())
+                tasks.put(('open', game_id, self._shared_name(game_id)))
+
+    def _shared_name(self, game_id):
+        return f'{self._prefix}_{self._index[game_id]}'
+
+    def submit(self, game_id, year, asset_1_choice, asset_2_choice, asset_3_choice, timeout=None):
+        '''
+        Отправить раунд игры (Choice + Gamble). Если в работе уже max_pending раундов, ждет
+        :return: Future, результат - (год, more_than_40)
+        '''
+        worker = self.assignment.get(game_id)
+        if worker is None:
+            raise KeyError(f'game {game_id!r} is not in the tournament')
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f'{self._slots._initial_value} rounds are already in progress')
+        future = Future()
+        task_id = next(self._task_ids)
+        message = ('round', task_id, game_id, year,
+                   (list(asset_1_choice), list(asset_2_choice), list(asset_3_choice)))
+        with self._lock:
+            broken = self._broken.get(game_id)
+            if broken is None:
+                self._pending[task_id] = (worker, message, future)
+                self._tasks[worker].put(message)
+        if broken is not None:
+            self._slots.release()
+            raise RuntimeError(f'game {game_id!r} is unavailable: {broken}')
+        return future
+
+    def _collect(self):
+        while not self._closed:
+            alive = [results for worker, results in enumerate(self._results) if worker not in self._dead]
+            for connection in wait(alive, timeout=0.2):
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):  # воркер упал, его перезапустит _check_workers
+                    continue
+                self._handle(message)
+            self._check_workers()
+
+    def _handle(self, message):
+        kind, key = message[0], message[1]
+        if kind == 'opened':
+            ids = message[2]
+            if key not in self.states:
+                self.states[key] = SharedState(self._shared_name(key), len(ids))
+                self.player_ids[key] = ids
+            with self._lock:
+                self._broken.pop(key, None)
+            if not self._opened[key].done():
+                self._opened[key].set_result(key)
+            return
+        if kind == 'broken':  # после перезапуска - тоже: раунды игры иначе ждали бы вечно
+            self._fail([key], message[2])
+            return
+        with self._lock:
+            entry = self._pending.pop(key, None)
+        if entry is None:  # повторный ответ на раунд, переотправленный после перезапуска
+            return
+        future = entry[2]
+        if kind == 'done':
+            future.set_result(message[2])
+        else:
+            future.set_exception(RuntimeError(message[2]))
+        self._slots.release()
+
+    def _check_workers(self):
+        for worker, process in enumerate(self._workers):
+            if process.is_alive() or self._closed or worker in self._dead:
+                continue
+            self._results[worker].close()
+            if self._worker_restarts[worker] >= self.max_restarts:
+                self._dead.add(worker)
+                self._fail([game_id for game_id, owner in self.assignment.items() if owner == worker],
+                           f'worker {worker} crashed {self._worker_restarts[worker] + 1} times '
+                           f'(exit code {process.exitcode})')
+                continue
+            self.restarts += 1
+            self._worker_restarts[worker] += 1
+            self._start(worker)
+            with self._lock:
+                resend = sorted((task_id, message) for task_id, (owner, message, _) in self._pending.items()
+                                if owner == worker)
+                for _, message in resend:
+                    self._tasks[worker].put(message)
+
+    def _fail(self, game_ids, reason):
+        '''
+        Игры больше недоступны: их открытие и раунды в работе завершаются с ошибкой, места освобождаются
+        '''
+        game_ids = set(game_ids)
+        with self._lock:
+            for game_id in game_ids:
+                self._broken[game_id] = reason
+            failed = [task_id for task_id, (_, message, _) in self._pending.items() if message[2] in game_ids]
+            futures = [self._pending.pop(task_id)[2] for task_id in failed]
+        for game_id in game_ids:
+            if not self._opened[game_id].done():
+                self._opened[game_id].set_exception(RuntimeError(reason))
+        for future in futures:
+            future.set_exception(RuntimeError(f'game is unavailable: {reason}'))
+            self._slots.release()
+
+    def state(self, game_id, timeout=1.0):
+        '''
+        :param timeout: сколько ждать, если воркер как раз пишет состояние (или упал посреди записи)
+        :return: (год, dict поле -> np.array по игрокам) - последнее опубликованное состояние игры
+        '''
+        year, values, _ = self._read(game_id, timeout)
+        return year, dict(zip(SHARED_FIELDS, values))
+
+    def _read(self, game_id, timeout):
+        try:
+            return self.states[game_id].read(timeout)
+        except TimeoutError as e:
+            raise TimeoutError(f'game {game_id!r} is unavailable: {e}') from None
+
+    def leaderboard(self, game_id):
+        '''
+        :return: leaderboard.LeaderboardSnapshot из разделяемой памяти
+        '''
+        from leaderboard import LeaderboardSnapshot
+
+        year, state = self.state(game_id)
+        return LeaderboardSnapshot(year, year, self.player_ids[game_id], state['TOTAL'])
+
+    def aggregates(self, game_id=None):
+        '''
+        :param game_id: None - по всем играм турнира
+        :return: aggregates.GameAggregates - состояние игроков и выборы последнего сыгранного раунда
+        '''
+        from aggregates import GameAggregates
+
+        merged = None
+        for game in self.game_ids if game_id is None else [game_id]:
+            year, values, round_ = self._read(game, 1.0)
+            state = dict(zip(SHARED_FIELDS, values))
+            one = GameAggregates().record_state(year, state['TOTAL'], state['educ'], state['mortgage_count'])
+            if round_ is not None:
+                one.rounds[year] = round_
+            merged = one if merged is None else merged.merge(one)
+        return merged
+
+    def close(self):
+        '''
+        Останавливает воркеры и удаляет разделяемую память
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        for tasks in self._tasks:
+            tasks.put(('stop',))
+        for process in self._workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._collector.join(timeout=1)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for _, _, future in pending.values():
+            future.set_exception(RuntimeError('tournament is closed'))
+        for results in self._results:
+            results.close()
+        for state in self.states.values():
+            name = state.memory.name
+            state.close()
+            try:
+                memory = SharedMemory(name)
+            except FileNotFoundError:
+                continue
+            memory.close()
+            memory.unlink()
+
+
+def _worker_main(tasks, results, directory, create, backend):
+    from checkpoints import CheckpointStore
+
+    games = {}  # game_id -> (Repository, SharedState)
+    while True:
+        message = tasks.get()
+        if message[0] == 'stop':
+            break
+        if message[0] == 'open':
+            _, game_id, name = message
+            store = CheckpointStore(os.path.join(directory, str(game_id)))
+            try:
+                if store.years():
+                    repo = store.load(backend=backend)
+                else:
+                    repo = create(game_id) if create is not None else _create_repository(game_id)
+                    repo.checkpoints = store
+            except Exception as e:
+                results.send(('broken', game_id, f'{type(e).__name__}: {e}'))
+                continue
+            shared = SharedState(name, len(repo.data), create=True)
+            shared.write(repo.year, repo.data, repo.aggregates.rounds.get(repo.year))
+            games[game_id] = repo, shared
+            results.send(('opened', game_id, list(repo.data.index)))
+            continue
+        _, task_id, game_id, year, choices = message
+        if game_id not in games:  # игра не открылась - координатор уже знает почему из 'broken'
+            results.send(('error', task_id, f'game {game_id!r} is not open'))
+            continue
+        repo, shared = games[game_id]
+        try:
+            if repo.year < year:  # после перезапуска раунд мог быть уже сыгран и записан в контрольную точку
+                repo.Choice(year, *choices)
+                repo.Gamble(year)
+                shared.write(year, repo.data, repo.aggregates.rounds.get(year))
+            results.send(('done', task_id, (repo.year, bool(repo.more_than_40))))
+        except Exception as e:
+            results.send(('error', task_id, f'{type(e).__name__}: {e}'))
+    for _, shared in games.values():
+        shared.close()
+
+
+def _create_repository(game_id):
+    from repository import Repository
+
+    return Repository(game_id)